@@ -17,7 +17,12 @@ setup(
     author_email=AUTHOR_EMAIL,
     license="BSD",
     url=URL,
-    packages=['styleguide'],
+    packages=[
+        'styleguide',
+        'styleguide.management',
+        'styleguide.management.commands',
+        'styleguide.templatetags',
+    ],
     install_requires = [
         'Django>=1.3',
         'docutils>=0.8',
@@ -0,0 +1,177 @@
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from django.conf import settings
+import styleguide
+from styleguide.models import StyleGuide, StyleGuideModifier, StyleGuideSection
+from styleguide.utils import atomic_write
+
+ARTIFACT = getattr(settings, 'STYLEGUIDE_ARTIFACT', None)
+
+ARTIFACT_MAGIC = b"KSSGUIDE"
+
+# bump whenever the layout of the header, index or data changes
+ARTIFACT_FORMAT = 1
+
+# magic, format, index length
+HEADER = struct.Struct("<8sII")
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+
+def write_artifact(guide, path):
+    """
+    Writes a built StyleGuide to path, with every description rendered.
+
+    The file is a fixed header, then a JSON index of the sections, then
+    the descriptions, which are only read when a section's desc is used.
+    :return: int size of the artifact in bytes
+    """
+
+    sections = []
+    data = []
+    offset = 0
+    for section in guide.sections:
+        desc = (section.desc or u"").encode('utf-8')
+        data.append(desc)
+        sections.append({
+            "position": section.position,
+            "title": section.title,
+            "desc": [offset, len(desc), hashlib.sha1(desc).hexdigest()],
+            "modifiers": [[m.modifier, m.description, m.template]
+                          for m in section.modifiers or ()],
+            "template": section.template,
+        })
+        offset += len(desc)
+
+    index = json.dumps({
+        "version": styleguide.__version__,
+        "title": guide.title,
+        "sections": sections,
+    }, separators=(",", ":")).encode('utf-8')
+    contents = b"".join([HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_FORMAT, len(index)), index] + data)
+    atomic_write(path, contents)
+    return len(contents)
+
+
+
+class Artifact(object):
+    """
+    A StyleGuide written by write_artifact.
+
+    The descriptions are memory-mapped rather than read, so processes
+    loading the same artifact share their pages, and each description is
+    decoded on first use. The artifact is the desc_renderer of its
+    sections, so it stays mapped as long as they're in use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        with open(self.path, 'rb') as artifact_file:
+            stat = os.fstat(artifact_file.fileno())
+            self.stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+            header = artifact_file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ArtifactError("%s is not a style guide artifact" % self.path)
+            magic, artifact_format, index_length = HEADER.unpack(header)
+            if magic != ARTIFACT_MAGIC:
+                raise ArtifactError("%s is not a style guide artifact" % self.path)
+            if artifact_format != ARTIFACT_FORMAT:
+                raise ArtifactError("%s has format %d, expected %d; rebuild it with "
+                                    "styleguide_build" % (self.path, artifact_format,
+                                                          ARTIFACT_FORMAT))
+            try:
+                self.index = json.loads(artifact_file.read(index_length).decode('utf-8'))
+            except ValueError:
+                raise ArtifactError("%s has a corrupt index" % self.path)
+            self.data_offset = HEADER.size + index_length
+            self.data = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        # mmaps can't be pickled; worker processes map the file again
+        return (self.path, self.stamp)
+
+    def __setstate__(self, state):
+        self.path, stamp = state
+        self.open()
+        if self.stamp != stamp:
+            raise ArtifactError("%s was rebuilt while in use" % self.path)
+
+    def __call__(self, desc_source):
+        """
+        :return: the rendered description at desc_source, an (offset,
+                 length, hash) tuple
+        """
+
+        offset, length = desc_source[0], desc_source[1]
+        start = self.data_offset + offset
+        return self.data[start:start + length].decode('utf-8')
+
+    def get_style_guide(self):
+        sections = []
+        for entry in self.index["sections"]:
+            desc_source = tuple(entry["desc"])
+            modifiers = [StyleGuideModifier(*modifier) for modifier in entry["modifiers"]]
+            if desc_source[1]:
+                section = StyleGuideSection(entry["position"], entry["title"], None,
+                                            modifiers, entry["template"],
+                                            desc_source=desc_source,
+                                            desc_renderer=self)
+            else:
+                section = StyleGuideSection(entry["position"], entry["title"], u"",
+                                            modifiers, entry["template"])
+            sections.append(section)
+        return StyleGuide(self.index["title"], sections)
+
+
+
+def load_artifact(path):
+    """
+    :return: StyleGuide loaded from the artifact at path
+    """
+
+    return Artifact(path).get_style_guide()
+
+
+def get_artifact_stamp(path):
+    """
+    :return: (mtime, size, inode) of the artifact, which changes whenever
+             it's rebuilt
+    """
+
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def get_artifact_last_modified(stamp):
+    return datetime.datetime.utcfromtimestamp(stamp[0])
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_artifact_guide(path, stamp=None):
+    """
+    :param stamp: the artifact's stamp, if already known
+    :return: StyleGuide from the artifact at path, loaded once per
+             process and again only when the artifact is rebuilt
+    """
+
+    if stamp is None:
+        stamp = get_artifact_stamp(path)
+    with _loaded_lock:
+        loaded = _loaded.get(path)
+        if loaded is None or loaded[0] != stamp:
+            loaded = _loaded[path] = (stamp, load_artifact(path))
+    return loaded[1]
@@ -0,0 +1,126 @@
+"""
+Views for ASGI deployments, which need Python 3 and Django >= 4.1.
+"""
+
+import asyncio
+import calendar
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from styleguide import metrics
+from styleguide.cache import get_fingerprint_hash, guide_cache
+from styleguide.views import SectionView
+
+# threads building guides, kept apart from the threads Django runs sync
+# code in, so a slow build can't take all of them
+ASYNC_BUILD_THREADS = getattr(settings, 'STYLEGUIDE_ASYNC_BUILD_THREADS', 2)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# builds in progress on each event loop, by collector and fingerprint
+_pending = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_BUILD_THREADS,
+                                           thread_name_prefix="styleguide-build")
+    return _executor
+
+
+async def get_entry(collector, fingerprint, request_metrics=None):
+    """
+    :param request_metrics: Metrics to count builds and joined builds in
+    :return: (fingerprint the guide was built for, StyleGuide), built in
+             an executor thread, with every concurrent caller for the
+             same fingerprint awaiting the same build
+    """
+
+    entry = guide_cache.get_current_entry(collector, fingerprint)
+    if entry is not None:
+        return entry
+
+    loop = asyncio.get_running_loop()
+    pending = _pending.setdefault(loop, {})
+    key = (guide_cache.get_cache_key(collector), get_fingerprint_hash(fingerprint))
+    future = pending.get(key)
+    counter = "async_build_joins" if future is not None else "async_builds"
+    if request_metrics is not None:
+        request_metrics.incr(counter)
+    if future is None:
+        future = loop.run_in_executor(get_executor(), guide_cache.get_entry,
+                                      collector, fingerprint)
+        pending[key] = future
+        future.add_done_callback(lambda done: pending.pop(key, None))
+    # a cancelled request mustn't cancel the build the others await
+    return await asyncio.shield(future)
+
+
+
+class AsyncSectionView(SectionView):
+    """
+    Renders a root section of the style guide without blocking the event
+    loop.
+
+    The fingerprint, the guide build and rendering run in threads, and
+    concurrent requests for the same guide share one build. Pages are
+    always rendered whole, not streamed.
+
+    Metrics are timed around each await, rather than activated, as
+    requests on one event loop share a thread.
+    """
+
+    streaming = False
+
+    async def get(self, request, *args, **kwargs):
+        self.metrics = metrics.Metrics("render")
+        loop = asyncio.get_running_loop()
+
+        with self.metrics.timer("fingerprint"):
+            # reads the collector's sources, or waits for the watcher
+            fingerprint = await loop.run_in_executor(get_executor(), getattr,
+                                                     self, 'fingerprint')
+
+        etag = self.get_etag(request, *args, **kwargs)
+        if etag:
+            etag = quote_etag(etag)
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+        if last_modified:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+
+        if response is None:
+            with self.metrics.timer("guide"):
+                built_for, guide = await self.get_guide_entry_async(fingerprint)
+            # a previous guide, served while another process builds
+            self.stale = built_for != fingerprint
+
+            context = self.get_section_context(guide, request.position)
+            response = self.render_to_response(context)
+            with self.metrics.timer("render"):
+                await loop.run_in_executor(None, response.render)
+
+            if last_modified and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+            if etag and not response.has_header('ETag'):
+                response['ETag'] = etag
+
+        return self.finish_response(request, response)
+
+    async def get_guide_entry_async(self, fingerprint):
+        """
+        :return: (fingerprint the guide was built for, StyleGuide)
+        """
+
+        if self.artifact or self.watch:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_executor(), self.get_guide_entry,
+                                              fingerprint)
+        return await get_entry(self.collector, fingerprint, self.metrics)
@@ -0,0 +1,215 @@
+import platform
+import random
+import time
+import styleguide
+from styleguide.builder import StyleGuideBuilder
+from styleguide.collector import CommentCollector
+from styleguide.export import StaticSiteExporter
+from styleguide.fragments import fragment_cache
+from styleguide.kss import compiled_templates, get_parser_class
+from styleguide.rendercache import description_cache
+from styleguide.scss import SCSSCommentParser
+
+STAGES = ("scss", "kss", "desc", "build", "render")
+
+WORDS = ("button", "primary", "layout", "grid", "spacing", "colour", "icon",
+         "heading", "state", "hover", "focus", "disabled", "inline", "block",
+         "*emphasis*", "``.literal``", "variant", "theme", "border", "shadow")
+
+
+def generate_corpus(files=10, sections=10, modifiers=3, desc_length=40,
+                    comment_style="//", seed=0):
+    """
+    Generates synthetic stylesheets with KSS documentation.
+
+    :param files: number of stylesheets, each a root section
+    :param sections: number of documented sections per stylesheet
+    :param modifiers: number of modifiers per section
+    :param desc_length: number of words in each description
+    :param comment_style: "//" or "/*"
+    :return: dict of filenames to stylesheet contents
+    """
+
+    rand = random.Random(seed)
+    corpus = {}
+    for i in range(1, files + 1):
+        out = []
+        for j in range(sections):
+            position = "%d" % i if j == 0 else "%d.%d" % (i, j)
+            lines = ["Section %s" % position, ""]
+            words = [rand.choice(WORDS) for _ in range(desc_length)]
+            for k in range(0, len(words), 12):
+                lines.append(" ".join(words[k:k + 12]))
+            lines.append("")
+            for k in range(modifiers):
+                lines.append(".mod-%d - %s" % (k, " ".join(rand.sample(WORDS, 4))))
+            if modifiers:
+                lines.extend([
+                    "",
+                    '    <div class="component {{ modifier }}">',
+                    '        <span>%s</span>' % rand.choice(WORDS),
+                    '    </div>',
+                ])
+            lines.extend(["", "Styleguide %s" % position])
+
+            if comment_style == "//":
+                out.extend(("// %s" % line).rstrip() for line in lines)
+            else:
+                out.append("/*")
+                out.extend((" * %s" % line).rstrip() for line in lines)
+                out.append(" */")
+            out.append(".component-%d-%d { color: #%06x; }" % (i, j, rand.randint(0, 0xffffff)))
+            out.append("")
+        corpus["generated-%04d.scss" % i] = "\n".join(out)
+    return corpus
+
+
+
+class CorpusCollector(CommentCollector):
+    """
+    Collects comments from an in-memory corpus of stylesheets.
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def get_sources(self):
+        return sorted(self.corpus)
+
+    def read_source(self, name):
+        return self.corpus[name]
+
+    def get_comments_list(self):
+        out = []
+        for name in self.get_sources():
+            out.extend(self.get_source_comments(name, self.read_source(name)))
+        return out
+
+
+
+def clear_caches():
+    description_cache.clear()
+    compiled_templates.clear()
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        clear_caches()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_stages(corpus, repeat=3, parser_class=None):
+    """
+    Times each stage of building and rendering a guide from corpus.
+    :param parser_class: KSS parser to time, by default the one set by
+                         the STYLEGUIDE_PARSER setting
+    :return: dict of stage names to the best time in seconds
+    """
+
+    if parser_class is None:
+        parser_class = get_parser_class()
+    collector = CorpusCollector(corpus)
+    blocks = collector.get_comments_list()
+    guide = StyleGuideBuilder(collector, parse_cache=False, workers=0,
+                              parser_class=parser_class).get_style_guide()
+    # render descriptions up front, so "render" times templates alone
+    for section in guide.sections:
+        section.desc
+
+    def scss():
+        for name in collector.get_sources():
+            SCSSCommentParser(collector.read_source(name), name).blocks()
+
+    def kss():
+        for block in blocks:
+            parser = parser_class(block)
+            if parser.is_valid_section():
+                parser.parse_section()
+
+    def desc():
+        for section in guide.sections:
+            section.desc_renderer(section.desc_source)
+
+    def build():
+        StyleGuideBuilder(collector, parse_cache=False, workers=0,
+                          parser_class=parser_class).get_style_guide()
+
+    exporter = StaticSiteExporter(output_dir=None, workers=0)
+
+    def render():
+        for section in guide.get_root_sections():
+            exporter.render_page(guide, section.position)
+
+    # time real rendering, not fragment cache hits
+    fragment_alias = fragment_cache.alias
+    fragment_cache.alias = None
+    try:
+        timings = {
+            "scss": best_time(scss, repeat),
+            "kss": best_time(kss, repeat),
+            "desc": best_time(desc, repeat),
+            "build": best_time(build, repeat),
+            "render": best_time(render, repeat),
+        }
+    finally:
+        fragment_cache.alias = fragment_alias
+    return timings
+
+
+def run_benchmarks(scales=(1, 4, 16), repeat=3, parser_class=None, **corpus_options):
+    """
+    Times every stage at each scale, multiplying the number of files.
+    :return: dict of results, suitable for dumping as JSON
+    """
+
+    files = corpus_options.pop("files", 10)
+    if parser_class is None:
+        parser_class = get_parser_class()
+    results = []
+    for scale in scales:
+        corpus = generate_corpus(files=files * scale, **corpus_options)
+        results.append({
+            "scale": scale,
+            "files": len(corpus),
+            "bytes": sum(len(contents) for contents in corpus.values()),
+            "stages": time_stages(corpus, repeat=repeat, parser_class=parser_class),
+        })
+
+    config = dict(corpus_options, files=files, scales=list(scales), repeat=repeat,
+                  parser="%s.%s" % (parser_class.__module__, parser_class.__name__))
+    return {
+        "version": styleguide.__version__,
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    :return: list of (scale, stage, baseline time, current time) for
+             every stage that got slower than the baseline by more than
+             threshold, as a fraction
+    """
+
+    baseline_stages = dict((result["scale"], result["stages"])
+                           for result in baseline["results"])
+    regressions = []
+    for result in current["results"]:
+        stages = baseline_stages.get(result["scale"])
+        if stages is None:
+            continue
+        for stage in STAGES:
+            if stage not in stages or stage not in result["stages"]:
+                continue
+            before = stages[stage]
+            after = result["stages"][stage]
+            if after > before * (1 + threshold):
+                regressions.append((result["scale"], stage, before, after))
+    return regressions
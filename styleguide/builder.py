@@ -1,33 +1,399 @@
+import bisect
+import logging
+import threading
+from django.conf import settings
 from styleguide.models import StyleGuide
-from styleguide.kss import KSSDocParser
+from styleguide.kss import get_parser_class
+from styleguide.metrics import Metrics
+from styleguide.parsecache import get_default_parse_cache
+from styleguide.renderers import get_renderer_name
+from styleguide.signals import guide_built
+from styleguide.utils import split_chunks
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport
+    ProcessPoolExecutor = None
+
+logger = logging.getLogger(__name__)
+
+BUILD_WORKERS = getattr(settings, 'STYLEGUIDE_BUILD_WORKERS', 0)
+
+# chunks handed to each worker process, to balance uneven sources
+CHUNKS_PER_WORKER = 4
+
+
+class BuildError(RuntimeError):
+    pass
+
+
+def _setup_worker():
+    # workers started by spawn or forkserver, rather than forked, begin
+    # with a fresh interpreter, whose app registry isn't populated yet
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def get_process_pool(workers):
+    """
+    :return: ProcessPoolExecutor whose worker processes have Django set up
+    """
+
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker)
+    except TypeError:
+        # the Python 2 futures backport, whose workers are always forked
+        return ProcessPoolExecutor(max_workers=workers)
+
+
+def _stats_delta(before, after):
+    return dict((key, value - before.get(key, 0)) for key, value in after.items())
+
+
+def _parse_sources(builder, names):
+    builder.metrics = Metrics("worker")
+    collector = builder.comment_collector
+    before = collector.get_stats()
+    sections = builder.parse_sources(names)
+    stats = _stats_delta(before, collector.get_stats())
+    return sections, builder.metrics.counters, stats
+
+
+def _parse_comments(builder, comments_list):
+    builder.metrics = Metrics("worker")
+    sections = builder.parse_comments(comments_list)
+    return sections, builder.metrics.counters, {}
 
 
 class StyleGuideBuilder(object):
     """
     Builds a StyleGuide from a collection of KSS-formatted
     doc comments.
+
+    With more than one worker, sources are read and parsed across a
+    process pool. Results are merged back in source order, so the guide
+    is the same as one built serially.
+
+    Comments are parsed with parser_class, by default the class named by
+    the STYLEGUIDE_PARSER setting.
+
+    Each build records per-stage timings and counters in self.metrics,
+    which are logged and sent with the guide_built signal.
     """
 
-    def __init__(self, comment_collector):
+    def __init__(self, comment_collector, parse_cache=None, workers=BUILD_WORKERS,
+                 parser_class=None):
         self.comment_collector = comment_collector
+        if parser_class is None:
+            parser_class = get_parser_class()
+        self.parser_class = parser_class
+        # parse_cache=False disables the cache configured in settings
+        if parse_cache is None:
+            parse_cache = get_default_parse_cache()
+        self.parse_cache = parse_cache
+        self.workers = workers
+        self.metrics = Metrics("build")
+        self._collector_stats = {}
 
     def get_style_guide(self):
-        # find all comment blocks
-        comments_list = self.comment_collector.get_comments_list()
+        self.start_metrics()
+        with self.metrics.activate():
+            sections = self.get_sections()
+            self.check_parse_errors(sections)
+
+            # order by position
+            with self.metrics.timer("sort"):
+                sections = sorted(sections, key=lambda section: section.sort_key)
+
+            # put together the StyleGuide instance
+            guide = StyleGuide("Style Guide", sections)
+        self.finish_metrics()
+        return guide
+
+    def check_parse_errors(self, sections):
+        """
+        Raises BuildError if sections failed to parse and none were
+        found, which points to a broken setup rather than broken comments.
+        """
+
+        counters = self.metrics.counters
+        if counters.get("parse_errors") and not sections:
+            raise BuildError("All %d sections failed to parse, see the log"
+                             % counters["parse_errors"])
+
+    def start_metrics(self):
+        self.metrics = Metrics("build")
+        self._collector_stats = self.comment_collector.get_stats()
+
+    def finish_metrics(self):
+        self.metrics.update(_stats_delta(self._collector_stats,
+                                         self.comment_collector.get_stats()))
+        self.metrics.log()
+        guide_built.send(sender=self.__class__, metrics=self.metrics)
+
+    def get_sections(self):
+        with self.metrics.timer("discover"):
+            sources = self.comment_collector.get_sources()
+        if sources is None:
+            # find all comment blocks
+            with self.metrics.timer("collect"):
+                comments_list = self.comment_collector.get_comments_list()
+            self.metrics.incr("blocks_found", len(comments_list))
+            if self.use_workers(comments_list):
+                sections = []
+                for chunk_sections in self.map_workers(_parse_comments, comments_list):
+                    sections.extend(chunk_sections)
+                return sections
+            return self.parse_comments(comments_list)
+
+        sections = []
+        for source_sections in self.parse_sources(sources):
+            sections.extend(source_sections)
+        self.prune_parse_cache()
+        return sections
+
+    def prune_parse_cache(self):
+        if self.parse_cache and self.metrics.counters.get("parse_cache_misses"):
+            with self.metrics.timer("prune"):
+                self.parse_cache.prune()
+
+    def parse_sources(self, names):
+        """
+        :return: list containing a list of StyleGuideSection per source
+        """
 
+        if self.use_workers(names):
+            out = []
+            for chunk_sections in self.map_workers(_parse_sources, names):
+                out.extend(chunk_sections)
+            return out
+
+        out = []
+        for name in names:
+            try:
+                out.append(self.get_source_sections(name))
+            except (IOError, OSError) as e:
+                # removed since it was listed
+                logger.debug("Skipping %s: %s" % (name, e))
+                out.append([])
+        return out
+
+    def use_workers(self, items):
+        if self.workers <= 1 or len(items) <= 1:
+            return False
+        if ProcessPoolExecutor is None:
+            logger.warning("STYLEGUIDE_BUILD_WORKERS needs concurrent.futures, "
+                           "building serially")
+            return False
+        return True
+
+    def map_workers(self, func, items):
+        """
+        Calls func(builder, chunk) for contiguous chunks of items across a
+        process pool, merging the counters each worker reports back.
+        :return: list of results, one per chunk in order
+        """
+
+        worker = self.get_worker_builder()
+        chunks = split_chunks(list(items), self.workers * CHUNKS_PER_WORKER)
+        out = []
+        with self.metrics.timer("workers"):
+            with get_process_pool(self.workers) as executor:
+                results = executor.map(func, [worker] * len(chunks), chunks)
+                for result, counters, stats in results:
+                    out.append(result)
+                    self.metrics.update(counters)
+                    self.comment_collector.add_stats(stats)
+        return out
+
+    def get_worker_builder(self):
+        """
+        :return: serial StyleGuideBuilder to be pickled to worker processes
+        """
+
+        return StyleGuideBuilder(self.comment_collector, parse_cache=self.parse_cache,
+                                 workers=0, parser_class=self.parser_class)
+
+    def get_source_sections(self, name):
+        """
+        :return: list of StyleGuideSection parsed from one source,
+                 loaded from the parse cache if it's unchanged
+        """
+
+        if not self.parse_cache:
+            # without a cache entry to key by the contents, large sources
+            # can be parsed as they're read; the read includes finding
+            # their comments
+            with self.metrics.timer("read"):
+                blocks = self.comment_collector.stream_source_comments(name)
+            if blocks is not None:
+                self.metrics.incr("sources_read")
+                self.metrics.incr("blocks_found", len(blocks))
+                return self.parse_comments(blocks)
+
+        with self.metrics.timer("read"):
+            contents = self.comment_collector.read_source(name)
+        self.metrics.incr("sources_read")
+        if not contents:
+            return []
+        if not self.parse_cache:
+            return self.parse_source(name, contents)
+
+        with self.metrics.timer("parse_cache"):
+            key = self.parse_cache.get_key(contents, self.get_parser_key())
+            sections = self.parse_cache.get(key)
+        if sections is not None:
+            self.metrics.incr("parse_cache_hits")
+            return sections
+
+        self.metrics.incr("parse_cache_misses")
+        sections = self.parse_source(name, contents)
+        with self.metrics.timer("parse_cache"):
+            self.parse_cache.set(key, sections)
+        return sections
+
+    def get_parser_key(self):
+        """
+        :return: str identifying the parser and description renderer that
+                 cached sections were built with
+        """
+
+        parser_class = self.parser_class
+        return "%s.%s:%s" % (parser_class.__module__, parser_class.__name__,
+                             get_renderer_name(parser_class.get_desc_renderer()))
+
+    def parse_source(self, name, contents):
+        with self.metrics.timer("comments"):
+            blocks = self.comment_collector.get_source_comments(name, contents)
+        self.metrics.incr("blocks_found", len(blocks))
+        return self.parse_comments(blocks)
+
+    def parse_comments(self, comments_list):
         # parse into StyleGuideSection
         sections = []
-        for raw_section in comments_list:
-            parser = KSSDocParser(raw_section)
-            if parser.is_valid_section():
-                sections.append(parser.parse_section())
+        with self.metrics.timer("parse"):
+            for raw_section in comments_list:
+                section = self.parse_comment(raw_section)
+                if section is not None:
+                    sections.append(section)
+        self.metrics.incr("sections_parsed", len(sections))
+        return sections
 
-        # order by position
-        sections = sorted(sections, key=lambda section: section.comparable_position())
+    def parse_comment(self, raw_section):
+        """
+        :return: StyleGuideSection, or None if the comment isn't a valid
+                 section or can't be parsed
+        """
 
-        # put together the StyleGuide instance
-        guide = StyleGuide("Style Guide", sections)
-        return guide
+        parser = self.parser_class(raw_section)
+        try:
+            if not parser.is_valid_section():
+                return None
+            return parser.parse_section()
+        except Exception:
+            # one broken comment shouldn't take the whole guide down
+            logger.exception("Skipping section that failed to parse: %r"
+                             % raw_section[:200])
+            self.metrics.incr("parse_errors")
+            return None
+
+
+
+class IncrementalStyleGuideBuilder(StyleGuideBuilder):
+    """
+    Builds a StyleGuide, remembering which sections came from which
+    source. Later builds reparse only the sources that were added,
+    changed or deleted, and merge their sections into the sorted
+    sections of the previous build.
+
+    Collectors without sources are rebuilt in full every time.
+    """
+
+    def __init__(self, comment_collector, parse_cache=None, parser_class=None):
+        super(IncrementalStyleGuideBuilder, self).__init__(
+            comment_collector, parse_cache=parse_cache, parser_class=parser_class)
+        self._lock = threading.Lock()
+        self._guide = None
+        self._keys = None
+        self._stamps = {}
+        self._source_sections = {}
+
+    def get_style_guide(self):
+        with self._lock:
+            sources = self.comment_collector.get_sources()
+            if sources is None:
+                return super(IncrementalStyleGuideBuilder, self).get_style_guide()
+
+            stamps = {}
+            changed = []
+            for name in sources:
+                stamps[name] = self.comment_collector.get_source_stamp(name)
+                if stamps[name] is None or name not in self._stamps \
+                        or self._stamps[name] != stamps[name]:
+                    changed.append(name)
+            removed = [name for name in self._stamps if name not in stamps]
+
+            if self._guide is not None and not changed and not removed:
+                return self._guide
+
+            self.start_metrics()
+            with self.metrics.activate():
+                guide = self.update_style_guide(changed, removed)
+            self._guide = guide
+            self._stamps = stamps
+            self.finish_metrics()
+            return guide
+
+    def update_style_guide(self, changed, removed):
+        """
+        :return: StyleGuide with sections from the changed sources
+                 reparsed, and sections from the removed sources dropped
+
+        Nothing is remembered until the update succeeds, so a failed
+        update leaves the previous build to update from next time.
+        """
+
+        logger.debug("Updating style guide: %d changed, %d removed sources"
+                     % (len(changed), len(removed)))
+
+        stale = set()
+        for name in changed + removed:
+            for section in self._source_sections.get(name, ()):
+                stale.add(id(section))
+
+        added = []
+        parsed = self.parse_sources(changed)
+        for source_sections in parsed:
+            added.extend(source_sections)
 
+        self.metrics.incr("sources_changed", len(changed))
+        self.metrics.incr("sources_removed", len(removed))
+        with self.metrics.timer("merge"):
+            if self._guide is None:
+                # only the first build can point to a broken setup; later
+                # ones just reparse whatever was edited
+                self.check_parse_errors(added)
+                sections = sorted(added, key=lambda section: section.sort_key)
+                keys = [section.sort_key for section in sections]
+            else:
+                # never modify the sections of a guide that's already handed out
+                sections = []
+                keys = []
+                for section, key in zip(self._guide.sections, self._keys):
+                    if id(section) not in stale:
+                        sections.append(section)
+                        keys.append(key)
+                for section in added:
+                    key = section.sort_key
+                    index = bisect.bisect_right(keys, key)
+                    keys.insert(index, key)
+                    sections.insert(index, section)
 
+        self.prune_parse_cache()
+        for name in removed:
+            self._source_sections.pop(name, None)
+        self._source_sections.update(zip(changed, parsed))
+        self._keys = keys
+        return StyleGuide("Style Guide", sections)
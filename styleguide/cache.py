@@ -0,0 +1,406 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from django.conf import settings
+from styleguide import metrics
+from styleguide.builder import IncrementalStyleGuideBuilder
+from styleguide.utils import atomic_write, get_cache_backend
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = getattr(settings, 'STYLEGUIDE_CACHE_ENABLED', True)
+
+# shares built guides between processes through a Django cache, or
+# failing that a directory
+SHARED_CACHE_ALIAS = getattr(settings, 'STYLEGUIDE_SHARED_CACHE_ALIAS', None)
+SHARED_CACHE_DIR = getattr(settings, 'STYLEGUIDE_SHARED_CACHE_DIR', None)
+SHARED_CACHE_TIMEOUT = getattr(settings, 'STYLEGUIDE_SHARED_CACHE_TIMEOUT', 24 * 60 * 60)
+# largest pickled guide shared through a Django cache; memcached drops
+# items over 1 MB without an error, so larger guides aren't stored
+SHARED_CACHE_MAX_SIZE = getattr(settings, 'STYLEGUIDE_SHARED_CACHE_MAX_SIZE', 1000 * 1000)
+
+# seconds before a build lock held by a dead process expires
+BUILD_LOCK_TIMEOUT = getattr(settings, 'STYLEGUIDE_BUILD_LOCK_TIMEOUT', 60)
+# seconds to wait for another process's build, when there's no
+# previous guide to serve meanwhile
+BUILD_WAIT = getattr(settings, 'STYLEGUIDE_BUILD_WAIT', 5)
+BUILD_WAIT_INTERVAL = 0.05
+
+
+def get_fingerprint_hash(fingerprint):
+    return hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+
+
+
+class CacheGuideStore(object):
+    """
+    Shares built guides between processes through a Django cache, using
+    cache.add() as the build lock.
+
+    Guides are stored pickled, and ones larger than max_size aren't
+    stored at all.
+    """
+
+    def __init__(self, alias, timeout=SHARED_CACHE_TIMEOUT,
+                 lock_timeout=BUILD_LOCK_TIMEOUT, key_prefix="styleguide-guide",
+                 max_size=SHARED_CACHE_MAX_SIZE):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.key_prefix = key_prefix
+        self.max_size = max_size
+
+    def get_key(self, key, fingerprint):
+        return "%s:%s:%s" % (self.key_prefix, hashlib.sha1(key.encode('utf-8')).hexdigest(),
+                             get_fingerprint_hash(fingerprint))
+
+    def get(self, key, fingerprint):
+        data = get_cache_backend(self.alias).get(self.get_key(key, fingerprint))
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            logger.warning("Ignoring unreadable shared guide for %s" % key)
+            return None
+
+    def set(self, key, fingerprint, guide):
+        data = pickle.dumps(guide, pickle.HIGHEST_PROTOCOL)
+        if self.max_size is not None and len(data) > self.max_size:
+            logger.warning("Not sharing a style guide of %d bytes, over "
+                           "STYLEGUIDE_SHARED_CACHE_MAX_SIZE; every process "
+                           "will build it" % len(data))
+            return
+        get_cache_backend(self.alias).set(self.get_key(key, fingerprint), data, self.timeout)
+
+    def acquire(self, key, fingerprint):
+        """
+        :return: lock to pass to release(), or None if another process
+                 holds it
+        """
+
+        lock_key = self.get_key(key, fingerprint) + ":lock"
+        token = "%d:%s" % (os.getpid(), uuid.uuid4().hex)
+        if get_cache_backend(self.alias).add(lock_key, token, self.lock_timeout):
+            return lock_key, token
+        return None
+
+    def release(self, lock):
+        # once the lock has expired, another process may hold it; there's
+        # no compare-and-delete, which leaves only a narrow window
+        lock_key, token = lock
+        cache = get_cache_backend(self.alias)
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+
+class FileGuideStore(object):
+    """
+    Shares built guides between processes on one host through a
+    directory, using fcntl locks, which are released even if the
+    building process dies.
+
+    Without fcntl, every process builds for itself.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def get_path(self, key, fingerprint, suffix):
+        filename = "%s-%s%s" % (hashlib.sha1(key.encode('utf-8')).hexdigest(),
+                                get_fingerprint_hash(fingerprint), suffix)
+        return os.path.join(self.directory, filename)
+
+    def get(self, key, fingerprint):
+        try:
+            with open(self.get_path(key, fingerprint, ".guide"), 'rb') as guide_file:
+                return pickle.load(guide_file)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.warning("Ignoring unreadable shared guide for %s" % key)
+            return None
+
+    def set(self, key, fingerprint, guide):
+        data = pickle.dumps(guide, pickle.HIGHEST_PROTOCOL)
+        path = self.get_path(key, fingerprint, ".guide")
+        try:
+            atomic_write(path, data)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to write shared guide: %s" % e)
+            return
+        self.remove_stale(path)
+
+    def remove_stale(self, current_path):
+        # drop guides of the same key written before this one; lock files
+        # are left alone, as another process may hold or be opening them
+        prefix = os.path.basename(current_path).split("-")[0] + "-"
+        try:
+            current_mtime = os.path.getmtime(current_path)
+        except OSError:
+            return
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.startswith(prefix) or not filename.endswith(".guide") \
+                    or path == current_path:
+                continue
+            try:
+                if os.path.getmtime(path) < current_mtime:
+                    os.remove(path)
+            except OSError:
+                # already removed by another process
+                pass
+
+    def acquire(self, key, fingerprint):
+        """
+        :return: lock to pass to release(), or None if another process
+                 holds it
+        """
+
+        lock_file = open(self.get_path(key, fingerprint, ".lock"), 'a')
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lock_file.close()
+            return None
+        return lock_file
+
+    def release(self, lock):
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        lock.close()
+
+
+
+def get_default_store():
+    """
+    :return: shared guide store configured by settings, or None
+    """
+
+    if SHARED_CACHE_ALIAS:
+        return CacheGuideStore(SHARED_CACHE_ALIAS)
+    if SHARED_CACHE_DIR:
+        return FileGuideStore(SHARED_CACHE_DIR)
+    return None
+
+
+
+class StyleGuideCache(object):
+    """
+    Keeps built StyleGuides for the lifetime of the process.
+
+    A guide is rebuilt only when the fingerprint of its collector
+    changes, so unchanged stylesheets are never parsed twice.
+    Collectors without a fingerprint are rebuilt on every request.
+
+    Builders are kept alongside the guides, so an incremental builder
+    only reparses the sources that changed since its last build.
+
+    With a shared store, only one process builds each fingerprint, and
+    publishes the guide for the others. While it builds, the others
+    serve the guide they already have, or wait for the new one.
+    """
+
+    def __init__(self, enabled=CACHE_ENABLED,
+                 builder_class=IncrementalStyleGuideBuilder, store=None,
+                 wait=BUILD_WAIT):
+        self.enabled = enabled
+        self.builder_class = builder_class
+        if store is None:
+            store = get_default_store()
+        self.store = store
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._builders = {}
+        self.reset_stats()
+
+    def get_cache_key(self, collector):
+        return collector.get_cache_key()
+
+    def get_style_guide(self, collector, fingerprint=None):
+        """
+        :param fingerprint: the collector's fingerprint, if already known
+        :return: StyleGuide for the collector, built only if out of date
+        """
+
+        return self.get_entry(collector, fingerprint)[1]
+
+    def get_entry(self, collector, fingerprint=None):
+        """
+        :param fingerprint: the collector's fingerprint, if already known
+        :return: (fingerprint the guide was built for, StyleGuide), where
+                 the fingerprint is an older one while another process
+                 builds the guide and the previous guide is served
+        """
+
+        if fingerprint is None and self.enabled:
+            fingerprint = collector.get_fingerprint()
+        if not self.enabled or fingerprint is None:
+            return fingerprint, self.build(collector)
+
+        key = self.get_cache_key(collector)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            return entry
+
+        if self.store:
+            guide = self.get_shared_style_guide(collector, key, fingerprint,
+                                                wait=entry is None)
+            if guide is None:
+                # another process is building; serve the previous guide
+                # rather than wait, and look again on the next request
+                self._count('stale_served')
+                return entry
+        else:
+            guide = self.build(collector)
+        entry = (fingerprint, guide)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def get_current_entry(self, collector, fingerprint):
+        """
+        :return: (fingerprint, StyleGuide) if a guide for fingerprint is
+                 already cached in this process, otherwise None
+        """
+
+        if not self.enabled or fingerprint is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(self.get_cache_key(collector))
+        if entry is not None and entry[0] == fingerprint:
+            return entry
+        return None
+
+    def get_shared_style_guide(self, collector, key, fingerprint, wait=True):
+        """
+        :return: StyleGuide for fingerprint published by any process,
+                 building and publishing it if none has, or None if
+                 another process is building it and wait is False
+        """
+
+        guide = self.store.get(key, fingerprint)
+        if guide is not None:
+            self._count('shared_hits')
+            return guide
+
+        lock = self.store.acquire(key, fingerprint)
+        if lock is None:
+            self._count('lock_contention')
+            if not wait:
+                return None
+            guide = self.wait_for_style_guide(key, fingerprint)
+            if guide is not None:
+                return guide
+            logger.warning("Timed out waiting for another process to build "
+                           "the style guide, building it here")
+            return self.build(collector)
+
+        try:
+            # published while the lock was being acquired
+            guide = self.store.get(key, fingerprint)
+            if guide is not None:
+                self._count('shared_hits')
+                return guide
+            guide = self.build(collector)
+            self.store.set(key, fingerprint, guide)
+            return guide
+        finally:
+            self.store.release(lock)
+
+    def wait_for_style_guide(self, key, fingerprint):
+        start = time.time()
+        try:
+            with metrics.timer("build_wait"):
+                while time.time() - start < self.wait:
+                    time.sleep(BUILD_WAIT_INTERVAL)
+                    guide = self.store.get(key, fingerprint)
+                    if guide is not None:
+                        self._count('shared_hits')
+                        return guide
+            return None
+        finally:
+            with self._lock:
+                self.stats['wait_time'] += time.time() - start
+
+    def build(self, collector):
+        logger.debug("Building style guide from %r" % collector)
+        self._count('builds')
+        if not self.enabled:
+            return self.builder_class(collector).get_style_guide()
+
+        key = self.get_cache_key(collector)
+        with self._lock:
+            builder = self._builders.get(key)
+            if builder is None:
+                builder = self._builders[key] = self.builder_class(collector)
+            else:
+                builder.comment_collector = collector
+        return builder.get_style_guide()
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+        metrics.incr("guide_cache_%s" % counter)
+
+    def reset_stats(self):
+        self.stats = {
+            'builds': 0,
+            'shared_hits': 0,
+            'lock_contention': 0,
+            'stale_served': 0,
+            'wait_time': 0.0,
+        }
+
+    def invalidate(self, collector=None):
+        """
+        Forgets the cached guide for a collector, or every cached guide
+        if no collector is given.
+        """
+
+        with self._lock:
+            if collector is None:
+                self._entries.clear()
+                self._builders.clear()
+            else:
+                key = self.get_cache_key(collector)
+                self._entries.pop(key, None)
+                self._builders.pop(key, None)
+
+
+
+guide_cache = StyleGuideCache()
+
+
+def get_style_guide(collector, fingerprint=None):
+    return guide_cache.get_style_guide(collector, fingerprint=fingerprint)
+
+
+def get_entry(collector, fingerprint=None):
+    return guide_cache.get_entry(collector, fingerprint=fingerprint)
+
+
+def invalidate(collector=None):
+    guide_cache.invalidate(collector)
@@ -1,14 +1,50 @@
+import calendar
+import datetime
+import fnmatch
+import hashlib
 import logging
+import mmap
 import os
+import time
+from contextlib import closing
 from django.conf import settings
 from styleguide.scss import SCSSCommentParser
+from styleguide.utils import import_string
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python 2 with the scandir backport
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 logger = logging.getLogger(__name__)
 
 FILE_COLLECTOR_ROOT = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_ROOT',
                               getattr(settings, 'STATIC_ROOT'))
+FILE_COLLECTOR_ROOTS = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_ROOTS',
+                               (FILE_COLLECTOR_ROOT,))
 FILE_COLLECTOR_EXTS = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_EXTS',
                               ('.css', '.less', '.sass', '.scss'))
+# glob patterns, matched against paths relative to a root and against
+# bare names; excluded directories are never descended into
+FILE_COLLECTOR_INCLUDE = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_INCLUDE', None)
+FILE_COLLECTOR_EXCLUDE = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_EXCLUDE',
+                                 ('.*', 'node_modules'))
+FILE_COLLECTOR_PREFILTER = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_PREFILTER', True)
+# files larger than this many bytes are parsed as they're read, rather
+# than read whole, unless a parse cache needs their contents
+FILE_COLLECTOR_STREAM_SIZE = getattr(settings, 'STYLEGUIDE_FILE_COLLECTOR_STREAM_SIZE',
+                                     4 * 1024 * 1024)
+FILE_COLLECTOR_ENCODING = 'utf-8'
+
+# the collector used by the views and management commands
+COLLECTOR = getattr(settings, 'STYLEGUIDE_COLLECTOR', 'styleguide.collector.FileCollector')
+
+# every KSS section declares its position with this token
+PREFILTER_TOKEN = b"Styleguide"
 
 
 class CommentCollector(object):
@@ -21,6 +57,92 @@ class CommentCollector(object):
 
         raise NotImplemented("Subclasses required to implement")
 
+    def get_cache_key(self):
+        """
+        Returns a key that's the same for collectors that would collect
+        the same comments, to share built guides between them.
+        :return: string
+        """
+
+        cls = self.__class__
+        return "%s.%s" % (cls.__module__, cls.__name__)
+
+    def get_fingerprint(self):
+        """
+        Returns a cheap summary of the collector's sources, which changes
+        whenever the comments it would collect may have changed.
+        :return: hashable value, or None if the sources can't be summarised
+        """
+
+        return None
+
+    def get_last_modified(self, fingerprint):
+        """
+        :return: datetime in UTC of the newest change described by a
+                 fingerprint, or None if unknown
+        """
+
+        return None
+
+    def get_sources(self):
+        """
+        Returns the names of the sources that comments are collected from,
+        for collectors that can read their sources one at a time.
+        :return: list of strings, or None if sources aren't supported
+        """
+
+        return None
+
+    def get_stats(self):
+        """
+        :return: dict of counters for the work done by the collector
+        """
+
+        return {}
+
+    def add_stats(self, stats):
+        """
+        Adds counters from a copy of this collector, such as one that
+        ran in a worker process.
+        """
+
+        pass
+
+    def get_source_stamp(self, name):
+        """
+        Returns a cheap summary of one source, which changes whenever
+        its contents may have changed.
+        :return: hashable value, or None if the source can't be summarised
+        """
+
+        return None
+
+    def read_source(self, name):
+        """
+        :return: string contents of the named source
+        """
+
+        raise NotImplementedError("Subclasses supporting sources required to implement")
+
+    def get_source_comments(self, name, contents):
+        """
+        Returns the comment blocks found in the contents of a source.
+        :return: list containing strings
+        """
+
+        parser = SCSSCommentParser(contents, os.path.basename(name))
+        return parser.blocks()
+
+    def stream_source_comments(self, name):
+        """
+        Returns the comment blocks of a source found as it's read, for
+        sources too large to read whole.
+        :return: list containing strings, or None if the source should
+                 be read with read_source
+        """
+
+        return None
+
 
 
 class ExampleCollector(CommentCollector):
@@ -67,33 +189,418 @@ class ExampleCollector(CommentCollector):
             """,
         ]
 
+    def get_fingerprint(self):
+        # the examples never change
+        return ()
+
 
 
 class FileCollector(CommentCollector):
     """
     Collects comment blocks from files that match a file search.
+
+    Files are searched for under each of the roots, skipping anything
+    that matches an exclude pattern, and keeping only files that match
+    an include pattern if any are given.
+
+    Files are prefiltered by scanning their raw bytes for the Styleguide
+    token, so files without KSS sections are never decoded or parsed.
+    Files with identical contents, such as the hashed copies written by
+    ManifestStaticFilesStorage, are parsed only once. Files larger than
+    stream_size are parsed as they're read, in constant memory.
     """
 
+    def __init__(self, prefilter=FILE_COLLECTOR_PREFILTER, roots=None,
+                 include=FILE_COLLECTOR_INCLUDE, exclude=FILE_COLLECTOR_EXCLUDE,
+                 stream_size=FILE_COLLECTOR_STREAM_SIZE):
+        self.prefilter = prefilter
+        self.stream_size = stream_size
+        if roots is None:
+            roots = FILE_COLLECTOR_ROOTS
+        self.roots = [root for root in roots if root]
+        self.include = include
+        self.exclude = exclude or ()
+        self.stats = {
+            'files_read': 0,
+            'bytes_read': 0,
+            'files_skipped': 0,
+            'bytes_skipped': 0,
+            'files_duplicate': 0,
+        }
+
+    def get_cache_key(self):
+        key = super(FileCollector, self).get_cache_key()
+        return "%s:%r" % (key, (tuple(self.roots), tuple(self.include or ()),
+                                tuple(self.exclude)))
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def add_stats(self, stats):
+        for key, value in stats.items():
+            self.stats[key] = self.stats.get(key, 0) + value
+
     def filename_is_match(self, filename):
         return any(filename.endswith(ext) for ext in FILE_COLLECTOR_EXTS)
 
-    def iterate_matching_files(self):
-        for root, dirs, files in os.walk(FILE_COLLECTOR_ROOT):
-            for f in files:
-                if self.filename_is_match(f):
-                    yield os.path.join(root, f)
+    def pattern_is_match(self, relpath, patterns):
+        name = relpath.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatchcase(relpath, pattern) or
+                   fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+    def path_is_match(self, relpath):
+        if self.include and not self.pattern_is_match(relpath, self.include):
+            return False
+        return not self.pattern_is_match(relpath, self.exclude)
+
+    def iterate_matching_files(self, directories=None):
+        """
+        :param directories: list to add each directory searched to
+        """
+
+        seen = set()
+        for root in self.roots:
+            for filepath in self.iterate_root(root, directories):
+                if filepath not in seen:
+                    seen.add(filepath)
+                    yield filepath
+
+    def iterate_root(self, root, directories=None):
+        """
+        Walks root like os.walk, without following symlinked directories,
+        and without descending into excluded directories.
+        :param directories: list to add each directory searched to
+        """
+
+        pending = [(root, "")]
+        while pending:
+            directory, prefix = pending.pop()
+            try:
+                entries = self.list_directory(directory)
+            except OSError:
+                # removed or unreadable since it was listed
+                continue
+            if directories is not None:
+                directories.append(directory)
+            subdirs = []
+            for name, is_dir in entries:
+                relpath = prefix + name
+                if is_dir:
+                    if not self.pattern_is_match(relpath, self.exclude):
+                        subdirs.append((os.path.join(directory, name), relpath + "/"))
+                elif self.filename_is_match(name) and self.path_is_match(relpath):
+                    yield os.path.join(directory, name)
+            pending.extend(reversed(subdirs))
+
+    def list_directory(self, directory):
+        """
+        :return: sorted list of (name, is_dir) for entries in directory,
+                 where symlinked directories don't count as directories
+        """
+
+        if scandir is not None:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False))
+                       for entry in scandir(directory)]
+        else:
+            entries = []
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                entries.append((name, os.path.isdir(path) and not os.path.islink(path)))
+        entries.sort()
+        return entries
+
+    def get_fingerprint(self):
+        # the directories searched are included, as removing a file
+        # changes only its directory's mtime
+        directories = []
+        stamps = []
+        for filepath in self.iterate_matching_files(directories):
+            stamp = self.get_source_stamp(filepath)
+            if stamp is not None:
+                stamps.append((filepath,) + stamp)
+        for directory in directories:
+            stamp = self.get_source_stamp(directory)
+            if stamp is not None:
+                stamps.append((os.path.join(directory, ""),) + stamp)
+        return tuple(sorted(stamps))
+
+    def get_last_modified(self, fingerprint):
+        if not fingerprint:
+            return None
+        newest = max(mtime for path, mtime, size in fingerprint)
+        return datetime.datetime.utcfromtimestamp(newest)
+
+    def get_source_stamp(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            # removed since the walk; the next fingerprint won't see it
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def get_sources(self):
+        return self.remove_duplicates(sorted(self.iterate_matching_files()))
+
+    def remove_duplicates(self, filepaths):
+        """
+        Drops files whose contents are identical to another file's. Only
+        files of the same size are hashed, and of each set of duplicates
+        the shortest path is kept, which for hashed static files is the
+        original name.
+        :return: list of the remaining filepaths, in their original order
+        """
+
+        by_size = {}
+        for filepath in filepaths:
+            stamp = self.get_source_stamp(filepath)
+            if stamp is None:
+                # removed since the walk; the builder will skip it
+                continue
+            by_size.setdefault(stamp[1], []).append(filepath)
+
+        duplicates = set()
+        for size, same_size in by_size.items():
+            if len(same_size) < 2 or size == 0:
+                continue
+            by_hash = {}
+            for filepath in same_size:
+                try:
+                    digest = self.get_content_hash(filepath)
+                except (IOError, OSError):
+                    continue
+                by_hash.setdefault(digest, []).append(filepath)
+            for same_contents in by_hash.values():
+                same_contents.sort(key=lambda filepath: (len(filepath), filepath))
+                duplicates.update(same_contents[1:])
+
+        self.stats['files_duplicate'] += len(duplicates)
+        return [filepath for filepath in filepaths if filepath not in duplicates]
+
+    def get_content_hash(self, filepath):
+        digest = hashlib.sha1()
+        with closing(self.open_source(filepath)) as src_file:
+            for chunk in iter(lambda: src_file.read(64 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def open_source(self, filepath):
+        return open(filepath, 'rb')
+
+    def get_file_size(self, src_file):
+        try:
+            return os.fstat(src_file.fileno()).st_size
+        except (AttributeError, EnvironmentError, ValueError):
+            # not a local file, e.g. opened from a remote storage
+            return getattr(src_file, 'size', None)
+
+    def read_source(self, filepath):
+        with closing(self.open_source(filepath)) as src_file:
+            if self.prefilter:
+                size = self.get_file_size(src_file)
+                if not self.contains_token(src_file, size):
+                    self.stats['files_skipped'] += 1
+                    self.stats['bytes_skipped'] += size or 0
+                    return u""
+            contents = src_file.read()
+        self.stats['files_read'] += 1
+        self.stats['bytes_read'] += len(contents)
+        return contents.decode(FILE_COLLECTOR_ENCODING, 'replace')
+
+    def stream_source_comments(self, filepath):
+        stamp = self.get_source_stamp(filepath)
+        if stamp is None or stamp[1] <= self.stream_size:
+            return None
+        size = stamp[1]
+
+        with closing(self.open_source(filepath)) as src_file:
+            if self.prefilter and not self.contains_token(src_file, size):
+                self.stats['files_skipped'] += 1
+                self.stats['bytes_skipped'] += size
+                return []
+            parser = SCSSCommentParser(src_file, os.path.basename(filepath),
+                                       encoding=FILE_COLLECTOR_ENCODING)
+            blocks = list(parser.iter_blocks())
+        self.stats['files_read'] += 1
+        self.stats['bytes_read'] += size
+        return blocks
+
+    def contains_token(self, src_file, size):
+        """
+        :return: bool True if the file may contain KSS sections
+        """
+
+        if size == 0:
+            return False
+        try:
+            mapped = mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, ValueError, EnvironmentError):
+            # not mappable, e.g. a pipe, special filesystem or remote storage
+            found = PREFILTER_TOKEN in src_file.read()
+            src_file.seek(0)
+            return found
+        try:
+            return mapped.find(PREFILTER_TOKEN) != -1
+        finally:
+            mapped.close()
 
     def get_comments_list(self):
         out = []
-        for filepath in self.iterate_matching_files():
-            src_file = open(filepath, 'r')
-            contents = src_file.read()
-            name = os.path.basename(filepath)
-            src_file.close()
-            parser = SCSSCommentParser(contents, name)
-            blocks = parser.blocks()
+        for filepath in self.get_sources():
+            blocks = self.stream_source_comments(filepath)
+            if blocks is None:
+                contents = self.read_source(filepath)
+                blocks = self.get_source_comments(filepath, contents)
             out.extend(blocks)
             logger.debug("%s: Found %d comment blocks"
                          % (filepath, len(blocks)))
 
+        if self.stats['files_skipped']:
+            logger.debug("Prefilter skipped %(files_skipped)d files "
+                         "(%(bytes_skipped)d bytes)" % self.stats)
         return out
+
+
+
+class StorageCollector(FileCollector):
+    """
+    Collects comment blocks from the files in a storage backend, by
+    default STATICFILES_STORAGE.
+
+    Source names are paths within the storage. Files on local storages
+    are read in place, anything else through the storage's open().
+    """
+
+    def __init__(self, storage=None, prefilter=FILE_COLLECTOR_PREFILTER,
+                 include=FILE_COLLECTOR_INCLUDE, exclude=FILE_COLLECTOR_EXCLUDE,
+                 stream_size=FILE_COLLECTOR_STREAM_SIZE):
+        super(StorageCollector, self).__init__(
+            prefilter=prefilter, roots=(), include=include, exclude=exclude,
+            stream_size=stream_size)
+        self.storage = storage
+        self._files = None
+
+    def __getstate__(self):
+        # storages are looked up again by worker processes
+        state = self.__dict__.copy()
+        state['_files'] = None
+        return state
+
+    def get_cache_key(self):
+        key = super(StorageCollector, self).get_cache_key()
+        if self.storage is None:
+            return key
+        cls = self.storage.__class__
+        return "%s:%s.%s:%r" % (key, cls.__module__, cls.__name__,
+                                getattr(self.storage, 'location', None))
+
+    def get_storage(self):
+        if self.storage is not None:
+            return self.storage
+        try:
+            from django.contrib.staticfiles.storage import staticfiles_storage
+        except ImportError:
+            # Django < 1.4
+            from django.core.files.storage import get_storage_class
+            return get_storage_class(settings.STATICFILES_STORAGE)()
+        return staticfiles_storage
+
+    def list_storage_files(self):
+        """
+        :return: iterable of (name, storage, path within storage), where
+                 earlier files take precedence over later ones of the
+                 same name
+        """
+
+        from django.contrib.staticfiles.utils import get_files
+        storage = self.get_storage()
+        for path in get_files(storage, list(self.exclude)):
+            yield path, storage, path
+
+    def get_last_modified(self, fingerprint):
+        # storages have no directory mtimes, so removing a file wouldn't
+        # move Last-Modified forward; the ETag alone tells
+        return None
+
+    def iterate_matching_files(self, directories=None):
+        files = {}
+        for name, storage, path in self.list_storage_files():
+            name = name.replace(os.sep, "/")
+            if name in files:
+                continue
+            if self.filename_is_match(name) and self.path_is_match(name):
+                files[name] = (storage, path)
+        self._files = files
+        return iter(files)
+
+    def get_file(self, name):
+        """
+        :return: (storage, path within storage) of the named source
+        """
+
+        if self._files is None:
+            list(self.iterate_matching_files())
+        try:
+            return self._files[name]
+        except KeyError:
+            raise IOError("%s is not in the storage" % name)
+
+    def get_local_path(self, name):
+        storage, path = self.get_file(name)
+        try:
+            return storage.path(path)
+        except NotImplementedError:
+            return None
+
+    def get_source_stamp(self, name):
+        try:
+            local_path = self.get_local_path(name)
+            if local_path is not None:
+                return super(StorageCollector, self).get_source_stamp(local_path)
+            storage, path = self.get_file(name)
+            # Django >= 1.10 renamed modified_time
+            get_modified_time = getattr(storage, 'get_modified_time', None) \
+                or storage.modified_time
+            modified = get_modified_time(path)
+            return (self.get_timestamp(modified), storage.size(path))
+        except (EnvironmentError, NotImplementedError):
+            return None
+
+    def get_timestamp(self, value):
+        if value.tzinfo is not None:
+            return calendar.timegm(value.utctimetuple())
+        return time.mktime(value.timetuple())
+
+    def open_source(self, name):
+        local_path = self.get_local_path(name)
+        if local_path is not None:
+            return open(local_path, 'rb')
+        storage, path = self.get_file(name)
+        return storage.open(path, 'rb')
+
+
+
+class StaticFilesCollector(StorageCollector):
+    """
+    Collects comment blocks from the files found by the staticfiles
+    finders, so the guide is built straight from app static directories
+    and STATICFILES_DIRS, without running collectstatic first.
+
+    Like findstatic, the first finder to list a path wins.
+    """
+
+    def list_storage_files(self):
+        from django.contrib.staticfiles import finders
+        for finder in finders.get_finders():
+            for path, storage in finder.list(list(self.exclude)):
+                prefix = getattr(storage, 'prefix', None)
+                name = os.path.join(prefix, path) if prefix else path
+                yield name, storage, path
+
+
+
+def get_default_collector():
+    """
+    :return: instance of the collector class named by STYLEGUIDE_COLLECTOR
+    """
+
+    return import_string(COLLECTOR)()
@@ -0,0 +1,105 @@
+import gzip
+import io
+import logging
+import os
+from django.conf import settings
+try:
+    from django.urls import reverse
+except ImportError:
+    # Django < 1.10
+    from django.core.urlresolvers import reverse
+from django.template.loader import render_to_string
+from styleguide.builder import BUILD_WORKERS, CHUNKS_PER_WORKER, ProcessPoolExecutor, \
+    get_process_pool
+from styleguide.utils import atomic_write, split_chunks
+from styleguide.views import SectionView
+
+logger = logging.getLogger(__name__)
+
+
+def _export_pages(exporter, guide, positions):
+    return [exporter.export_page(guide, position) for position in positions]
+
+
+
+class StaticSiteExporter(object):
+    """
+    Writes every root section page of a StyleGuide to a directory, using
+    the same templates and context as SectionView.
+
+    Pages are laid out like their URLs, e.g. section/1/index.html, so
+    the directory can be served as-is. Pages whose HTML hasn't changed
+    are left untouched, and precompressed .gz copies can be written
+    next to each page.
+    """
+
+    def __init__(self, output_dir, workers=BUILD_WORKERS, gzip=False):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.gzip = gzip
+
+    def export(self, guide):
+        """
+        :return: list of page paths that were written
+        """
+
+        positions = [section.position for section in guide.get_root_sections()]
+        if self.workers > 1 and len(positions) > 1 and ProcessPoolExecutor is not None:
+            chunks = split_chunks(positions, self.workers * CHUNKS_PER_WORKER)
+            with get_process_pool(self.workers) as executor:
+                results = executor.map(_export_pages, [self] * len(chunks),
+                                       [guide] * len(chunks), chunks)
+                written = [path for chunk in results for path in chunk]
+        else:
+            written = _export_pages(self, guide, positions)
+        return [path for path in written if path is not None]
+
+    def render_page(self, guide, position):
+        view = SectionView()
+        context = view.get_section_context(guide, position)
+        context.setdefault("STATIC_URL", settings.STATIC_URL)
+        return render_to_string(view.get_section_template_names(position), context)
+
+    def get_page_path(self, position):
+        url = reverse("styleguide_section", kwargs={"position": position})
+        return os.path.join(self.output_dir, url.strip("/"), "index.html")
+
+    def export_page(self, guide, position):
+        """
+        :return: path of the page if it was written, or None if unchanged
+        """
+
+        html = self.render_page(guide, position).encode('utf-8')
+        path = self.get_page_path(position)
+        written = self.write_if_changed(path, html)
+        if self.gzip and (written or not os.path.exists(path + ".gz")):
+            self.write_if_changed(path + ".gz", self.compress(html))
+        if written:
+            logger.debug("Wrote %s" % path)
+            return path
+        return None
+
+    def compress(self, data):
+        buf = io.BytesIO()
+        # a fixed mtime keeps the output identical for identical pages
+        gz_file = gzip.GzipFile(filename="", mode='wb', fileobj=buf,
+                                compresslevel=9, mtime=0)
+        gz_file.write(data)
+        gz_file.close()
+        return buf.getvalue()
+
+    def write_if_changed(self, path, data):
+        if os.path.exists(path):
+            with open(path, 'rb') as existing:
+                if existing.read() == data:
+                    return False
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another worker in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        atomic_write(path, data)
+        return True
@@ -0,0 +1,186 @@
+import copy
+import hashlib
+import re
+import threading
+import uuid
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from styleguide import metrics
+from styleguide.renderers import get_renderer_name
+from styleguide.utils import get_cache_backend
+
+FRAGMENT_CACHE_ALIAS = getattr(settings, 'STYLEGUIDE_FRAGMENT_CACHE_ALIAS', None)
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'STYLEGUIDE_FRAGMENT_CACHE_TIMEOUT', 60 * 60)
+
+SECTION_TEMPLATE = "styleguide/styleguide_section.html"
+
+# the section template and every template it extends
+FRAGMENT_TEMPLATES = (
+    SECTION_TEMPLATE,
+    "styleguide/base_section.html",
+)
+
+
+def _iter_loaders(loaders):
+    for loader in loaders:
+        # cached loaders wrap the loaders that do the work
+        for wrapped in _iter_loaders(getattr(loader, 'loaders', ())):
+            yield wrapped
+        yield loader
+
+
+def get_template_source(name):
+    """
+    :return: source of the named template, or None if it can't be found
+    """
+
+    template = get_template(name)
+    source = getattr(getattr(template, 'template', template), 'source', None)
+    if source is not None:
+        return source
+
+    # Django < 1.9 doesn't keep the source on templates, ask the loaders
+    from django.template import loader
+    for template_loader in _iter_loaders(loader.template_source_loaders or ()):
+        if not hasattr(template_loader, 'load_template_source'):
+            continue
+        try:
+            return template_loader.load_template_source(name)[0]
+        except (TemplateDoesNotExist, NotImplementedError):
+            continue
+    return None
+
+
+def get_section_hash(section):
+    """
+    :return: hex digest of everything a section's fragment is built from
+    """
+
+    if section.desc_renderer is not None:
+        desc = (section.desc_source, get_renderer_name(section.desc_renderer))
+    else:
+        desc = section.desc
+    modifiers = [(m.modifier, m.description, m.template)
+                 for m in section.modifiers or ()]
+    content = (section.position, section.title, desc, modifiers, section.template)
+    return hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+
+
+class FragmentCache(object):
+    """
+    Renders the HTML fragment of each section, caching it in a Django
+    cache keyed by a hash of the section's content and the source of the
+    section templates.
+
+    Cached fragments must depend only on the section, not on the rest of
+    the page context.
+    """
+
+    def __init__(self, alias=FRAGMENT_CACHE_ALIAS, timeout=FRAGMENT_CACHE_TIMEOUT,
+                 template_name=SECTION_TEMPLATE, key_prefix="styleguide-fragment"):
+        self.alias = alias
+        self.timeout = timeout
+        self.template_name = template_name
+        self.key_prefix = key_prefix
+        self._templates_hash = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+        }
+
+    def get_templates_hash(self):
+        # templates only change on deploy, except while developing
+        if self._templates_hash is None or settings.DEBUG:
+            digest = hashlib.sha1()
+            for name in FRAGMENT_TEMPLATES:
+                source = get_template_source(name) or name
+                if not isinstance(source, bytes):
+                    source = source.encode('utf-8')
+                digest.update(source)
+                digest.update(b"\0")
+            self._templates_hash = digest.hexdigest()
+        return self._templates_hash
+
+    def get_key(self, section):
+        return "%s:%s:%s" % (self.key_prefix, self.get_templates_hash(),
+                             get_section_hash(section))
+
+    def render(self, section, context):
+        """
+        :return: HTML fragment for section, rendered with context
+        """
+
+        backend = get_cache_backend(self.alias)
+        if backend is None:
+            return self.render_uncached(section, context)
+
+        key = self.get_key(section)
+        html = backend.get(key)
+        if html is not None:
+            self._count('hits')
+            return html
+
+        self._count('misses')
+        html = self.render_uncached(section, context)
+        backend.set(key, html, self.timeout)
+        return html
+
+    def render_uncached(self, section, context):
+        template = get_template(self.template_name)
+        # Django >= 1.8 wraps templates for the generic backend API
+        template = getattr(template, 'template', template)
+        context.push()
+        try:
+            context['section'] = section
+            return template.render(context)
+        finally:
+            context.pop()
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+        metrics.incr("fragment_cache_%s" % counter)
+
+
+
+fragment_cache = FragmentCache()
+
+
+
+class FragmentStream(object):
+    """
+    Defers the rendering of section fragments while a page is rendered,
+    leaving a marker in their place, so the page can be sent in pieces
+    with each fragment rendered only as it's reached.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or fragment_cache
+        self.token = uuid.uuid4().hex
+        self.deferred = []
+
+    def defer(self, section, context):
+        """
+        :return: marker to be replaced by the section's fragment
+        """
+
+        self.deferred.append((section, copy.copy(context)))
+        return "<!--styleguide-section-%s-%d-->" % (self.token, len(self.deferred) - 1)
+
+    def iter_page(self, page):
+        """
+        :return: generator of the pieces of page, with each marker
+                 replaced by its rendered fragment
+        """
+
+        pieces = re.split(r"<!--styleguide-section-%s-(\d+)-->" % self.token, page)
+        for i, piece in enumerate(pieces):
+            if i % 2 == 0:
+                if piece:
+                    yield piece
+            else:
+                section, context = self.deferred[int(piece)]
+                yield self.cache.render(section, context)
@@ -1,7 +1,79 @@
 import re
-from django.template import Template, Context
-from docutils.core import publish_parts
-from styleguide.models import StyleGuideSection
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from styleguide import metrics
+from styleguide.models import StyleGuideModifier, StyleGuideSection
+# imported from here by earlier versions
+from styleguide.renderers import (DOCUTILS_SETTINGS, DOCUTILS_SETTINGS_KEY,
+                                  get_default_renderer, publish_restructuredtext,
+                                  render_restructuredtext)
+from styleguide.utils import LRUCache, import_string
+
+TEMPLATE_CACHE_SIZE = 500
+
+# the KSS parser class; KSSTokenParser parses the same sections, faster
+PARSER = getattr(settings, 'STYLEGUIDE_PARSER', 'styleguide.kss.KSSDocParser')
+
+# kinds of token read by KSSTokenParser
+POSITION = "position"
+TITLE = "title"
+DESCRIPTION = "description"
+MODIFIER = "modifier"
+CONTINUATION = "continuation"
+MARKUP = "markup"
+
+
+compiled_templates = LRUCache(TEMPLATE_CACHE_SIZE)
+
+
+def compile_template(template_string):
+    """
+    :return: Template compiled from template_string, shared by every
+             section with the same example markup
+    """
+
+    template = compiled_templates.get(template_string)
+    if template is None:
+        # django.template is only imported once a template is compiled
+        from django.template import Template
+        with metrics.timer("template_compile"):
+            template = Template(template_string)
+        compiled_templates.set(template_string, template)
+    return template
+
+
+def get_substitution_parts(template, name):
+    """
+    :return: list of the text around each {{ name }} in a compiled
+             template, or None if the template does more than substitute
+             name, unfiltered
+    """
+
+    from django.template.base import TextNode, VariableNode
+
+    parts = []
+    text = []
+    for node in template.nodelist:
+        if isinstance(node, TextNode):
+            text.append(node.s)
+        elif isinstance(node, VariableNode) and not node.filter_expression.filters \
+                and getattr(node.filter_expression.var, 'lookups', None) == (name,):
+            parts.append(u"".join(text))
+            text = []
+        else:
+            return None
+    parts.append(u"".join(text))
+    return parts
+
+
+def get_parser_class():
+    """
+    :return: the parser class named by the STYLEGUIDE_PARSER setting
+    """
+
+    return import_string(PARSER)
+
 
 
 class KSSDocParser(object):
@@ -28,14 +100,26 @@ class KSSDocParser(object):
 
     The position in the style guide is determined by the
     Styleguide declaration.
+
+    The description is kept as source on the section, and only rendered
+    by desc_renderer when it's first displayed. desc_renderer defaults to
+    the STYLEGUIDE_DESC_RENDERER setting.
     """
 
     styleguide_position_re = re.compile(r"Styleguide (\S+)")
     leading_spaces_re = re.compile(r"^\s*")
 
+    # a plain function, so sections holding it can still be pickled, or
+    # None for the default renderer
+    desc_renderer = None
+
     def __init__(self, content):
         self.content = content
 
+    @classmethod
+    def get_desc_renderer(cls):
+        return cls.desc_renderer or get_default_renderer()
+
     def is_valid_section(self):
         """
         :return: bool True if content can be parsed
@@ -53,7 +137,12 @@ class KSSDocParser(object):
         blocks, raw_template, template = self._parse_template(blocks)
         blocks, modifiers = self._parse_modifiers(blocks, raw_template)
         blocks, title = self._parse_title(blocks)
-        blocks, desc = self._parse_desc(blocks)
+        blocks, desc_source = self._parse_desc(blocks)
+
+        desc = None
+        if not desc_source.strip():
+            # nothing worth rendering later
+            desc = u""
 
         return StyleGuideSection(
             position=position,
@@ -61,6 +150,8 @@ class KSSDocParser(object):
             desc=desc,
             modifiers=modifiers,
             template=template,
+            desc_source=desc_source,
+            desc_renderer=self.get_desc_renderer(),
         )
 
     def _parse_position(self, blocks):
@@ -87,24 +178,27 @@ class KSSDocParser(object):
 
         last_indent = None
         if modifier_block:
+            compiled_template = None
+            if raw_template is not None:
+                compiled_template = compile_template(raw_template)
             for line in modifier_block.split("\n"):
                 indent = self._get_indent(line)
                 if last_indent and indent > last_indent:
-                    modifiers[-1]['description'] += line
+                    modifiers[-1].description += line
                 elif " - " in line:
                     modifier, desc = line.split(" - ")
                     modifier_template = None
-                    if raw_template is not None:
+                    if compiled_template is not None:
                         modifier_class = modifier.lstrip(".")
-                        modifier_template = self._render_template(
-                            raw_template, {
+                        modifier_template = self._render_compiled_template(
+                            compiled_template, {
                                 'modifier': modifier_class,
                             })
-                    modifiers.append({
-                        'modifier': modifier,
-                        'description': desc,
-                        'template': modifier_template,
-                    })
+                    modifiers.append(StyleGuideModifier(
+                        modifier=modifier,
+                        description=desc,
+                        template=modifier_template,
+                    ))
                     last_indent = indent
                 else:
                     last_indent = None
@@ -131,21 +225,20 @@ class KSSDocParser(object):
     def _parse_desc(self, blocks):
 
         desc_source = "\n\n".join(blocks)
-        return [], self._parse_restructuredtext(desc_source)
+        return [], desc_source
 
     def _parse_restructuredtext(self, source):
-        parts = publish_parts(
-            source=source,
-            parser_name='restructuredtext',
-            settings_overrides={'file_insertion_enabled': 0, 'raw_enabled': 0},
-            writer_name='html')
-        return parts['body']
+        # renders straight away, rather than on first access
+        return self.get_desc_renderer()(source)
 
     def _get_indent(self, line):
         return len(self.leading_spaces_re.search(line).group(0))
 
     def _render_template(self, template_string, vars):
-        tpl = Template(template_string)
+        return self._render_compiled_template(compile_template(template_string), vars)
+
+    def _render_compiled_template(self, tpl, vars):
+        from django.template import Context
         context = Context(vars)
         return tpl.render(context)
 
@@ -165,3 +258,140 @@ class KSSDocParser(object):
 
 
 
+class KSSTokenParser(KSSDocParser):
+    """
+    Parses the same format as KSSDocParser into the same sections, in a
+    single pass over the comment.
+
+    The comment is split into lines once, and each line is read into a
+    token (position, title, description, modifier, continuation or
+    markup) as blocks are found, instead of rejoining and resplitting
+    the blocks for every part of the section. Modifier templates that
+    only substitute {{ modifier }} are filled in without rendering a
+    template for each modifier.
+    """
+
+    def tokenize(self):
+        """
+        :return: iterator of (kind, value) tokens, in the order of the
+                 comment
+        """
+
+        text = self._trim_lines(self.content.split("\n")).strip()
+        state = {MARKUP: False, MODIFIER: False, TITLE: False}
+        block = None
+        # a blank line ends the block only if another line follows it
+        pending_break = False
+        for line in text.split("\n"):
+            if "Styleguide " in line:
+                match = self.styleguide_position_re.search(line)
+                if match:
+                    yield POSITION, match.group(1)
+                    continue
+            if block is None:
+                block = [line]
+            elif pending_break:
+                for token in self._block_tokens(block, state):
+                    yield token
+                block = [line]
+                pending_break = False
+            elif not line:
+                pending_break = True
+            else:
+                block.append(line)
+
+        if block is None:
+            block = [""]
+        elif pending_break:
+            block.append("")
+        for token in self._block_tokens(block, state):
+            yield token
+
+    def _block_tokens(self, lines, state):
+        block = "\n".join(lines)
+        # everything from the first markup block on is the template
+        if state[MARKUP] or block.strip().startswith("<"):
+            state[MARKUP] = True
+            yield MARKUP, self._trim_lines(lines)
+        elif not state[MODIFIER] and " - " in block:
+            state[MODIFIER] = True
+            for token in self._modifier_tokens(lines):
+                yield token
+        elif not state[TITLE]:
+            state[TITLE] = True
+            yield TITLE, block.strip()
+        else:
+            yield DESCRIPTION, block
+
+    def _modifier_tokens(self, lines):
+        last_indent = None
+        for line in lines:
+            indent = self._get_indent(line)
+            if last_indent and indent > last_indent:
+                yield CONTINUATION, line
+            elif " - " in line:
+                modifier, desc = line.split(" - ")
+                yield MODIFIER, (modifier, desc)
+                last_indent = indent
+            else:
+                last_indent = None
+
+    def parse_section(self):
+        """
+        :return: StyleGuideSection from parsing content
+        """
+
+        position = None
+        title = None
+        desc_blocks = []
+        template_blocks = []
+        modifiers = []
+        for kind, value in self.tokenize():
+            if kind == POSITION:
+                position = value
+            elif kind == TITLE:
+                title = value
+            elif kind == DESCRIPTION:
+                desc_blocks.append(value)
+            elif kind == MODIFIER:
+                modifiers.append(StyleGuideModifier(value[0], value[1], None))
+            elif kind == CONTINUATION:
+                modifiers[-1].description += value
+            else:
+                template_blocks.append(value)
+        if title is None:
+            raise ValueError("Section has no title")
+
+        compiled_template = compile_template("\n\n".join(template_blocks))
+        parts = get_substitution_parts(compiled_template, 'modifier')
+        template = self._render_modifier_template(compiled_template, parts, '')
+        for modifier in modifiers:
+            modifier.template = self._render_modifier_template(
+                compiled_template, parts, modifier.modifier.lstrip("."))
+
+        desc_source = "\n\n".join(desc_blocks)
+        desc = None
+        if not desc_source.strip():
+            # nothing worth rendering later
+            desc = u""
+
+        return StyleGuideSection(
+            position=position,
+            title=title,
+            desc=desc,
+            modifiers=modifiers,
+            template=template,
+            desc_source=desc_source,
+            desc_renderer=self.get_desc_renderer(),
+        )
+
+    def _render_modifier_template(self, tpl, parts, modifier_class):
+        if parts is None:
+            return self._render_compiled_template(tpl, {'modifier': modifier_class})
+        # what the template engine would render, without a Context per modifier
+        return mark_safe(escape(modifier_class).join(parts))
+
+    def _trim_lines(self, lines):
+        indents = [self._get_indent(line) for line in lines if line.strip()]
+        indent = min(indents) if indents else 0
+        return "\n".join(line[indent:] if line.strip() else "" for line in lines)
@@ -0,0 +1,102 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from styleguide.benchmark import compare_results, run_benchmarks
+from styleguide.utils import import_string
+
+
+
+class Command(BaseCommand):
+    help = ("Times each stage of building and rendering a style guide from "
+            "synthetic stylesheets, optionally failing on regressions "
+            "against a stored baseline.")
+
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--files', type='int', dest='files', default=10,
+                    help="Number of stylesheets at scale 1."),
+        make_option('--sections', type='int', dest='sections', default=10,
+                    help="Number of sections per stylesheet."),
+        make_option('--modifiers', type='int', dest='modifiers', default=3,
+                    help="Number of modifiers per section."),
+        make_option('--desc-length', type='int', dest='desc_length', default=40,
+                    help="Number of words per description."),
+        make_option('--comment-style', dest='comment_style', default='//',
+                    choices=['//', '/*'], help="Comment style: // or /*."),
+        make_option('--scales', dest='scales', default='1,4,16',
+                    help="Comma-separated multipliers of the number of stylesheets."),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+                    help="Runs per stage; the best time is kept."),
+        make_option('--parser', dest='parser', default=None,
+                    help="Dotted path of the KSS parser class to time."),
+        make_option('--output', dest='output', default=None,
+                    help="Write results as JSON to this file instead of stdout."),
+        make_option('--compare', dest='compare', default=None,
+                    help="Baseline JSON results to compare against."),
+        make_option('--threshold', type='float', dest='threshold', default=0.2,
+                    help="Allowed slowdown against the baseline, as a fraction."),
+    )
+
+    def add_arguments(self, parser):
+        # Django >= 1.8 uses argparse instead of option_list
+        parser.add_argument('--files', type=int, dest='files', default=10,
+                            help="Number of stylesheets at scale 1.")
+        parser.add_argument('--sections', type=int, dest='sections', default=10,
+                            help="Number of sections per stylesheet.")
+        parser.add_argument('--modifiers', type=int, dest='modifiers', default=3,
+                            help="Number of modifiers per section.")
+        parser.add_argument('--desc-length', type=int, dest='desc_length', default=40,
+                            help="Number of words per description.")
+        parser.add_argument('--comment-style', dest='comment_style', default='//',
+                            choices=['//', '/*'], help="Comment style: // or /*.")
+        parser.add_argument('--scales', dest='scales', default='1,4,16',
+                            help="Comma-separated multipliers of the number of stylesheets.")
+        parser.add_argument('--repeat', type=int, dest='repeat', default=3,
+                            help="Runs per stage; the best time is kept.")
+        parser.add_argument('--parser', dest='parser', default=None,
+                            help="Dotted path of the KSS parser class to time.")
+        parser.add_argument('--output', dest='output', default=None,
+                            help="Write results as JSON to this file instead of stdout.")
+        parser.add_argument('--compare', dest='compare', default=None,
+                            help="Baseline JSON results to compare against.")
+        parser.add_argument('--threshold', type=float, dest='threshold', default=0.2,
+                            help="Allowed slowdown against the baseline, as a fraction.")
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(",")]
+        except ValueError:
+            raise CommandError("--scales must be comma-separated integers")
+        parser_class = None
+        if options['parser']:
+            try:
+                parser_class = import_string(options['parser'])
+            except (ImportError, AttributeError, ValueError):
+                raise CommandError("Unable to import parser %s" % options['parser'])
+
+        results = run_benchmarks(
+            scales=scales,
+            repeat=options['repeat'],
+            parser_class=parser_class,
+            files=options['files'],
+            sections=options['sections'],
+            modifiers=options['modifiers'],
+            desc_length=options['desc_length'],
+            comment_style=options['comment_style'],
+        )
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output + "\n")
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare_results(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against %s:\n%s" % (
+                    options['compare'], "\n".join(
+                        "  scale %d, %s: %.4fs -> %.4fs" % regression
+                        for regression in regressions)))
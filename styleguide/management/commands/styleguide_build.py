@@ -0,0 +1,35 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from styleguide.artifact import ARTIFACT, write_artifact
+from styleguide.builder import BUILD_WORKERS, StyleGuideBuilder
+from styleguide.collector import get_default_collector
+
+
+
+class Command(BaseCommand):
+    help = ("Builds the style guide and writes it to an artifact, which "
+            "SectionView loads instead of parsing stylesheets.")
+    args = "[<artifact_path>]"
+
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--workers', type='int', dest='workers', default=BUILD_WORKERS,
+                    help="Number of processes to build with."),
+    )
+
+    def add_arguments(self, parser):
+        # Django >= 1.8 uses argparse instead of option_list
+        parser.add_argument('artifact_path', nargs='?', default=None)
+        parser.add_argument('--workers', type=int, dest='workers', default=BUILD_WORKERS,
+                            help="Number of processes to build with.")
+
+    def handle(self, *args, **options):
+        path = options.get('artifact_path') or (args[0] if args else None) or ARTIFACT
+        if not path:
+            raise CommandError("Usage: styleguide_build %s, or set STYLEGUIDE_ARTIFACT"
+                               % self.args)
+
+        guide = StyleGuideBuilder(get_default_collector(),
+                                  workers=options['workers']).get_style_guide()
+        size = write_artifact(guide, path)
+        self.stdout.write("Wrote %d sections to %s (%d bytes).\n"
+                          % (len(guide.sections), path, size))
@@ -0,0 +1,42 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from styleguide.artifact import ARTIFACT, get_artifact_guide
+from styleguide.builder import BUILD_WORKERS, StyleGuideBuilder
+from styleguide.collector import get_default_collector
+from styleguide.export import StaticSiteExporter
+
+
+
+class Command(BaseCommand):
+    help = "Exports the style guide as pre-rendered static HTML pages."
+    args = "<output_dir>"
+
+    option_list = getattr(BaseCommand, 'option_list', ()) + (
+        make_option('--workers', type='int', dest='workers', default=BUILD_WORKERS,
+                    help="Number of processes to build and render with."),
+        make_option('--gzip', action='store_true', dest='gzip', default=False,
+                    help="Also write a precompressed .gz copy of each page."),
+    )
+
+    def add_arguments(self, parser):
+        # Django >= 1.8 uses argparse instead of option_list
+        parser.add_argument('output_dir')
+        parser.add_argument('--workers', type=int, dest='workers', default=BUILD_WORKERS,
+                            help="Number of processes to build and render with.")
+        parser.add_argument('--gzip', action='store_true', dest='gzip', default=False,
+                            help="Also write a precompressed .gz copy of each page.")
+
+    def handle(self, *args, **options):
+        output_dir = options.get('output_dir') or (args[0] if args else None)
+        if not output_dir:
+            raise CommandError("Usage: styleguide_export %s" % self.args)
+
+        workers = options['workers']
+        if ARTIFACT:
+            guide = get_artifact_guide(ARTIFACT)
+        else:
+            guide = StyleGuideBuilder(get_default_collector(), workers=workers).get_style_guide()
+        exporter = StaticSiteExporter(output_dir, workers=workers, gzip=options['gzip'])
+        written = exporter.export(guide)
+        self.stdout.write("Exported %d sections, %d pages changed.\n"
+                          % (len(guide.sections), len(written)))
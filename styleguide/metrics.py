@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_TRACE_MEMORY = getattr(settings, 'STYLEGUIDE_METRICS_TRACE_MEMORY', False)
+
+_local = threading.local()
+
+# tracemalloc is process-wide, so it's started by the first activation
+# tracing memory and stopped by the last
+_tracing_lock = threading.Lock()
+_tracing_count = 0
+_started_tracing = False
+
+
+
+class Metrics(object):
+    """
+    Per-stage timers and counters for one guide build or page render.
+
+    While a Metrics is active, code further down the stack can add to
+    it through the module-level timer() and incr(), without having it
+    passed in.
+    """
+
+    def __init__(self, name, trace_memory=METRICS_TRACE_MEMORY):
+        self.name = name
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.timings = {}
+        self.counters = {}
+        self.peak_memory = None
+        self._stage_order = []
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            if stage not in self.timings:
+                self.timings[stage] = 0.0
+                self._stage_order.append(stage)
+            self.timings[stage] += time.time() - start
+
+    def incr(self, counter, count=1):
+        self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def update(self, counters):
+        for counter, count in counters.items():
+            self.incr(counter, count)
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this the current Metrics of the thread, tracing memory
+        allocations if enabled.
+
+        The peak is of memory allocated while active, above what was
+        allocated when activated. Activations that overlap, in other
+        threads or nested, share the peak of the first of them.
+        """
+
+        baseline = self.start_tracing() if self.trace_memory else None
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+            if baseline is not None:
+                self.peak_memory = self.stop_tracing() - baseline
+
+    def start_tracing(self):
+        """
+        :return: bytes traced when tracing started for this activation
+        """
+
+        global _tracing_count, _started_tracing
+        with _tracing_lock:
+            if not _tracing_count:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _started_tracing = True
+                elif hasattr(tracemalloc, 'reset_peak'):
+                    # Python >= 3.9
+                    tracemalloc.reset_peak()
+            _tracing_count += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    def stop_tracing(self):
+        """
+        :return: peak bytes traced
+        """
+
+        global _tracing_count, _started_tracing
+        with _tracing_lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            _tracing_count -= 1
+            if not _tracing_count and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+            return peak
+
+    def as_dict(self):
+        out = {
+            "name": self.name,
+            "timings": dict(self.timings),
+            "counters": dict(self.counters),
+        }
+        if self.peak_memory is not None:
+            out["peak_memory"] = self.peak_memory
+        return out
+
+    def get_server_timing(self):
+        """
+        :return: value for a Server-Timing header, in milliseconds
+        """
+
+        return ", ".join("%s;dur=%.1f" % (stage, self.timings[stage] * 1000)
+                         for stage in self._stage_order)
+
+    def log(self):
+        logger.info("%s: %s" % (self.name, ", ".join(
+            ["%s=%.1fms" % (stage, self.timings[stage] * 1000)
+             for stage in self._stage_order] +
+            ["%s=%s" % item for item in sorted(self.counters.items())])),
+            extra={"styleguide_metrics": self.as_dict()})
+
+
+
+def current():
+    """
+    :return: the active Metrics of the thread, or None
+    """
+
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def timer(stage):
+    metrics = current()
+    if metrics is None:
+        yield
+    else:
+        with metrics.timer(stage):
+            yield
+
+
+def incr(counter, count=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.incr(counter, count)
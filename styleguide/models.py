@@ -1,27 +1,70 @@
 import re
-from pkg_resources import parse_version
 
 
 
 class StyleGuide(object):
     """
     A StyleGuide has many sections of stylesheet documentation.
+
+    Sections are indexed by position once, when the guide is built, so
+    looking up a subtree, the root sections or the parent and children
+    of a section doesn't scan every section.
     """
 
     def __init__(self, title, sections):
         self.title = title
         self.sections = sections
+        self._index_sections()
+
+    def _index_sections(self):
+        self._positions = {}
+        self._subtrees = {}
+        self._children = {}
+        self._root_sections = []
+        for section in self.sections:
+            self._positions.setdefault(section.position, section)
+            parts = section.position.split(".")
+            for i in range(1, len(parts) + 1):
+                prefix = ".".join(parts[:i])
+                self._subtrees.setdefault(prefix, []).append(section)
+            if len(parts) == 1:
+                self._root_sections.append(section)
+            else:
+                parent_position = ".".join(parts[:-1])
+                self._children.setdefault(parent_position, []).append(section)
 
     def get_sections(self, position=""):
         if position != "":
             position = position.rstrip(".")
-            prefix_position_re = re.compile("^" + re.escape(position) + r"($|\.)")
-            return [s for s in self.sections if prefix_position_re.search(s.position)]
+            return self._subtrees.get(position, [])
         else:
             return self.sections
 
     def get_root_sections(self):
-        return filter(lambda s: s.depth() == 0, self.sections)
+        return self._root_sections
+
+    def get_section(self, position):
+        """
+        :return: StyleGuideSection at position, or None
+        """
+
+        return self._positions.get(position.rstrip("."))
+
+    def get_parent(self, section):
+        """
+        :return: StyleGuideSection containing section, or None
+        """
+
+        if section.depth() == 0:
+            return None
+        return self.get_section(section.position.rsplit(".", 1)[0])
+
+    def get_children(self, section):
+        """
+        :return: list of StyleGuideSection directly below section
+        """
+
+        return self._children.get(section.position, [])
 
     def __unicode__(self):
         return u"%s" % self.title
@@ -31,26 +74,116 @@ class StyleGuide(object):
 
 
 
+_leading_digits_re = re.compile(r"\d+")
+
+
+def position_sort_key(position):
+    """
+    :return: tuple of ints ordering positions numerically, so that
+             "1.2" sorts before "1.11"
+    """
+
+    key = []
+    for part in position.split("."):
+        digits = _leading_digits_re.match(part)
+        key.append(int(digits.group(0)) if digits else 0)
+    return tuple(key)
+
+
+
 class StyleGuideSection(object):
     """
     A section of stylesheet documentation.
+
+    Sections use __slots__ to stay small in large guides, and parse
+    their position into a sort key once, at construction.
+
+    A section may keep the source of its description along with a
+    renderer, instead of the rendered desc. The description is then
+    rendered on first access and remembered.
     """
 
-    def __init__(self, position, title, desc, modifiers, template):
+    __slots__ = ('position', 'title', '_desc', 'desc_source', 'desc_renderer',
+                 'modifiers', 'template', 'sort_key', '_depth')
+
+    def __init__(self, position, title, desc, modifiers, template,
+                 desc_source=None, desc_renderer=None):
         self.position = position.rstrip(".")
         self.title = title
-        self.desc = desc
+        self._desc = desc
+        self.desc_source = desc_source
+        self.desc_renderer = desc_renderer
         self.modifiers = modifiers
         self.template = template
+        self.sort_key = position_sort_key(self.position)
+        self._depth = self.position.count(".")
+
+    def _get_desc(self):
+        if self._desc is None and self.desc_renderer is not None:
+            self._desc = self.desc_renderer(self.desc_source)
+        return self._desc
+
+    def _set_desc(self, desc):
+        self._desc = desc
+
+    desc = property(_get_desc, _set_desc)
 
     def comparable_position(self):
-        return parse_version(self.position)
+        return self.sort_key
 
     def depth(self):
-        return len(filter(lambda c: c==".", self.position))
+        return self._depth
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
 
     def __unicode__(self):
         return u"%s %s" % (self.position, self.title)
 
     def __repr__(self):
         return u"<StyleGuideSection %s>" % unicode(self)
+
+
+
+
+class StyleGuideModifier(object):
+    """
+    A modifier class of a section, with its example markup.
+    """
+
+    __slots__ = ('modifier', 'description', 'template')
+
+    def __init__(self, modifier, description, template):
+        self.modifier = modifier
+        self.description = description
+        self.template = template
+
+    def __getitem__(self, key):
+        # dict-style access, as modifiers used to be dicts
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, StyleGuideModifier):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __getstate__(self):
+        return (self.modifier, self.description, self.template)
+
+    def __setstate__(self, state):
+        self.modifier, self.description, self.template = state
+
+    def __repr__(self):
+        return "<StyleGuideModifier %s>" % self.modifier
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pickle
+from django.conf import settings
+import styleguide
+from styleguide.utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_DIR = getattr(settings, 'STYLEGUIDE_PARSE_CACHE_DIR', None)
+PARSE_CACHE_MAX_SIZE = getattr(settings, 'STYLEGUIDE_PARSE_CACHE_MAX_SIZE',
+                               50 * 1024 * 1024)
+
+ENTRY_SUFFIX = ".sections"
+
+# bump whenever the pickled StyleGuideSection attributes change
+ENTRY_FORMAT = 4
+
+
+class ParseCache(object):
+    """
+    Stores the StyleGuideSections parsed from each source on disk.
+
+    Entries are keyed by a hash of the source contents, and named after
+    the package version and entry format so that entries written by other
+    versions can be told apart and evicted first.
+    """
+
+    def __init__(self, directory, max_size=PARSE_CACHE_MAX_SIZE,
+                 version=styleguide.__version__):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def version_prefix(self):
+        return "%s.f%d" % (self.version, ENTRY_FORMAT)
+
+    def get_key(self, contents, parser_key=""):
+        """
+        :param parser_key: identifies how contents are parsed, so that
+                           sections parsed differently don't collide
+        """
+
+        if not isinstance(contents, bytes):
+            contents = contents.encode('utf-8')
+        digest = hashlib.sha1(parser_key.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(contents)
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        filename = "%s-%s%s" % (self.version_prefix(), key, ENTRY_SUFFIX)
+        return os.path.join(self.directory, filename)
+
+    def get(self, key):
+        """
+        :return: list of StyleGuideSection, or None on a cache miss
+        """
+
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                sections = pickle.load(entry_file)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.warning("Ignoring unreadable parse cache entry %s" % path)
+            return None
+
+        # mark as recently used, so it's evicted last
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return sections
+
+    def set(self, key, sections):
+        data = pickle.dumps(sections, pickle.HIGHEST_PROTOCOL)
+        try:
+            atomic_write(self.get_path(key), data)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to write parse cache entry: %s" % e)
+
+    def prune(self):
+        """
+        Evicts entries from other package versions, then the least
+        recently used entries until the cache fits in max_size.
+        """
+
+        current_prefix = "%s-" % self.version_prefix()
+        entries = []
+        stale = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, filename)
+            if not filename.startswith(current_prefix):
+                stale.append(path)
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for mtime, size, path in entries)
+        evicted = stale
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            evicted.append(path)
+            total_size -= size
+
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+        if evicted:
+            logger.debug("Evicted %d parse cache entries" % len(evicted))
+
+
+
+def get_default_parse_cache():
+    """
+    :return: ParseCache configured by settings, or None if disabled
+    """
+
+    if not PARSE_CACHE_DIR:
+        return None
+    return ParseCache(PARSE_CACHE_DIR)
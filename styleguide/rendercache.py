@@ -0,0 +1,94 @@
+import hashlib
+import threading
+from django.conf import settings
+from styleguide import metrics
+from styleguide.utils import LRUCache, get_cache_backend
+
+DESC_CACHE_SIZE = getattr(settings, 'STYLEGUIDE_DESC_CACHE_SIZE', 1000)
+DESC_CACHE_ALIAS = getattr(settings, 'STYLEGUIDE_DESC_CACHE_ALIAS', None)
+
+
+
+class RenderCache(object):
+    """
+    Memoizes rendered HTML by a hash of its source and the renderer's
+    settings.
+
+    Lookups go to an in-process LRU first, then to a shared Django cache
+    if an alias is configured, so every worker and every rebuild reuses
+    descriptions that were rendered before.
+    """
+
+    def __init__(self, size=DESC_CACHE_SIZE, alias=DESC_CACHE_ALIAS,
+                 key_prefix="styleguide-desc"):
+        self.local = LRUCache(size)
+        self.alias = alias
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def get_key(self, source, settings_key):
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        digest = hashlib.sha1(settings_key.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(source)
+        return "%s:%s" % (self.key_prefix, digest.hexdigest())
+
+    def render(self, source, renderer, settings_key):
+        """
+        :return: renderer(source), rendered only if not already cached
+        """
+
+        key = self.get_key(source, settings_key)
+        html = self.local.get(key)
+        if html is not None:
+            self._count('hits')
+            return html
+
+        shared = get_cache_backend(self.alias)
+        if shared is not None:
+            html = shared.get(key)
+            if html is not None:
+                self._count('shared_hits')
+                self.local.set(key, html)
+                return html
+
+        self._count('misses')
+        html = renderer(source)
+        self.local.set(key, html)
+        if shared is not None:
+            shared.set(key, html)
+        return html
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+        metrics.incr("desc_cache_%s" % counter)
+
+    def reset_stats(self):
+        self.stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+        }
+
+    def get_stats(self):
+        """
+        :return: dict of hit and miss counters, and the overall hit rate
+        """
+
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        if lookups:
+            stats['hit_rate'] = float(stats['hits'] + stats['shared_hits']) / lookups
+        else:
+            stats['hit_rate'] = 0.0
+        return stats
+
+    def clear(self):
+        self.local.clear()
+
+
+
+description_cache = RenderCache()
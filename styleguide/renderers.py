@@ -0,0 +1,116 @@
+import re
+import threading
+from django.conf import settings
+from styleguide import metrics
+from styleguide.rendercache import description_cache
+from styleguide.utils import import_string
+
+# renders section descriptions: a function taking the description source
+# and returning HTML, which must be importable so sections can be pickled
+DESC_RENDERER = getattr(settings, 'STYLEGUIDE_DESC_RENDERER',
+                        'styleguide.renderers.render_restructuredtext')
+
+DOCUTILS_SETTINGS = {'file_insertion_enabled': 0, 'raw_enabled': 0}
+DOCUTILS_SETTINGS_KEY = "restructuredtext:html:%r" % sorted(DOCUTILS_SETTINGS.items())
+
+# bump whenever render_text's output changes
+TEXT_SETTINGS_KEY = "text:html:1"
+
+
+def publish_restructuredtext(source):
+    # docutils takes a while to import, and isn't needed until a
+    # description is first rendered
+    from docutils.core import publish_parts
+
+    with metrics.timer("docutils"):
+        parts = publish_parts(
+            source=source,
+            parser_name='restructuredtext',
+            settings_overrides=DOCUTILS_SETTINGS,
+            writer_name='html')
+    return parts['body']
+
+
+def render_restructuredtext(source):
+    """
+    :return: HTML body rendered from reStructuredText source, reusing
+             any earlier rendering of the same source
+    """
+
+    return description_cache.render(source, publish_restructuredtext,
+                                    DOCUTILS_SETTINGS_KEY)
+
+
+
+_paragraph_break_re = re.compile(r"\n[ \t]*\n")
+_inline_re = re.compile(r"``(.+?)``"
+                        r"|\*\*(?=\S)(.+?)(?<=\S)\*\*"
+                        r"|\*(?=[^\s*])(.+?)(?<=\S)\*", re.S)
+
+
+def escape(text):
+    return (text.replace(u"&", u"&amp;").replace(u"<", u"&lt;")
+            .replace(u">", u"&gt;").replace(u'"', u"&quot;"))
+
+
+def publish_inline(text):
+    out = []
+    position = 0
+    for match in _inline_re.finditer(text):
+        literal, strong, emphasis = match.groups()
+        out.append(escape(text[position:match.start()]))
+        if literal is not None:
+            out.append(u"<code>%s</code>" % escape(literal))
+        elif strong is not None:
+            out.append(u"<strong>%s</strong>" % escape(strong))
+        else:
+            out.append(u"<em>%s</em>" % escape(emphasis))
+        position = match.end()
+    out.append(escape(text[position:]))
+    return u"".join(out)
+
+
+def publish_text(source):
+    paragraphs = []
+    for paragraph in _paragraph_break_re.split(source):
+        paragraph = paragraph.strip()
+        if paragraph:
+            paragraphs.append(u"<p>%s</p>\n" % publish_inline(paragraph))
+    return u"".join(paragraphs)
+
+
+def render_text(source):
+    """
+    :return: HTML body rendered from plain text, much faster than
+             docutils: paragraphs, *emphasis*, **strong** and ``literals``
+             are marked up, and everything else is escaped
+    """
+
+    return description_cache.render(source, publish_text, TEXT_SETTINGS_KEY)
+
+
+
+def get_renderer_name(renderer):
+    """
+    :return: dotted path of a renderer, to key what it renders by
+    """
+
+    # renderers are functions, or callable objects such as an Artifact
+    name = getattr(renderer, '__name__', renderer.__class__.__name__)
+    return "%s.%s" % (renderer.__module__, name)
+
+
+_default_renderer = None
+_default_renderer_lock = threading.Lock()
+
+
+def get_default_renderer():
+    """
+    :return: the renderer named by the STYLEGUIDE_DESC_RENDERER setting
+    """
+
+    global _default_renderer
+    with _default_renderer_lock:
+        if _default_renderer is None:
+            _default_renderer = import_string(DESC_RENDERER)
+    return _default_renderer
@@ -5,11 +5,26 @@
 import re
 
 
+# unicode on Python 2, str on Python 3
+text_type = type(u"")
+
+
 class SCSSCommentParser(object):
+    """
+    Finds the comment blocks in a stylesheet.
+
+    The source is a string, or a file object or iterator of lines, which
+    is read as it's parsed, so large bundles never need to be held in
+    memory whole. Bytes are decoded line by line.
+    """
 
-    def __init__(self, source, name=None):
+    # bytes read from a file object at a time
+    chunk_size = 64 * 1024
+
+    def __init__(self, source, name=None, encoding='utf-8'):
         self.name = name if name is not None else "<not specified>"
         self.source = source
+        self.encoding = encoding
         self._blocks = None
 
     _single_line_comment_re = re.compile(r"^\s*//")
@@ -45,67 +60,127 @@ class SCSSCommentParser(object):
         return self._blocks
 
     def parse_blocks(self):
-
-        current_block = ""
-        inside_single_line_block = False
-        inside_multi_line_block  = False
-        blocks = []
-        lines = self.source.split("\n")
+        return list(self.iter_blocks())
+
+    def iter_lines(self):
+        """
+        :return: iterator of the source's lines, split on newlines alone,
+                 with an empty last line after a final newline
+        """
+
+        if isinstance(self.source, text_type):
+            return iter(self.source.split(u"\n"))
+        if isinstance(self.source, bytes):
+            return (self._decode(line) for line in self.source.split(b"\n"))
+        if hasattr(self.source, 'read'):
+            return self._split_chunks(self._read_chunks(self.source))
+        return self._iter_source_lines(self.source)
+
+    def _iter_source_lines(self, lines):
+        # lines, which may or may not end with their newline, read as if
+        # the last one did
         for line in lines:
+            line = self._decode(line)
+            if line.endswith(u"\n"):
+                line = line[:-1]
+            yield line
+        yield u""
+
+    def _read_chunks(self, src_file):
+        while True:
+            chunk = src_file.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _split_chunks(self, chunks):
+        pending = []
+        empty = u""
+        for chunk in chunks:
+            empty = chunk[:0]
+            parts = chunk.split(b"\n" if isinstance(chunk, bytes) else u"\n")
+            pending.append(parts[0])
+            for part in parts[1:]:
+                yield self._decode(empty.join(pending))
+                pending = [part]
+        yield self._decode(empty.join(pending))
+
+    def _decode(self, line):
+        if isinstance(line, bytes):
+            # newlines never occur within a multibyte character, so
+            # decoding each line alone decodes like the whole file
+            return line.decode(self.encoding, 'replace')
+        return line
+
+    # one match tells a single-line comment from the start of a multi-line one
+    _comment_start_re = re.compile(r"^\s*/([/*])")
+
+    def iter_blocks(self):
+        """
+        :return: iterator of the normalized comment blocks, found as the
+                 source is read
+        """
+
+        current_block = []
+        inside_single_line_block = False
+        inside_multi_line_block = False
+        for line in self.iter_lines():
+            start = self._comment_start_re.match(line)
+            single_line_comment = start is not None and start.group(1) == "/"
+
             # Parse single-line style
-            if self.is_single_line_comment(line):
+            if single_line_comment:
                 parsed = self.parse_single_line(line)
                 if inside_single_line_block:
-                    current_block += "\n%s" % parsed
+                    current_block.append(parsed)
                 else:
-                    current_block = unicode(parsed)
+                    current_block = [text_type(parsed)]
                     inside_single_line_block = True
 
             # Parse multi-lines style
-            if self.is_start_multi_line_comment(line) or inside_multi_line_block:
+            if (start is not None and not single_line_comment) or inside_multi_line_block:
                 parsed = self.parse_multi_line(line)
                 if inside_multi_line_block:
-                    current_block += "\n%s" % parsed
+                    current_block.append(parsed)
                 else:
-                    current_block = parsed
+                    current_block = [parsed]
                     inside_multi_line_block = True
 
             # End a multi-line block if detected
-            if self.is_end_multi_line_comment(line):
+            if "*/" in line:
                 inside_multi_line_block = False
 
-            # Store the current block if we're done
-            if not(self.is_single_line_comment(line) or inside_multi_line_block):
-                if current_block:
-                    blocks.append(self.normalize(current_block))
+            # Yield the current block if we're done
+            if not (single_line_comment or inside_multi_line_block):
+                block = "\n".join(current_block)
+                if block:
+                    yield self.normalize(block)
                 inside_single_line_block = False
-                current_block = ""
+                current_block = []
 
-        return blocks
+    _check_preceding_re = re.compile(r"^(\s*\*+)")
+    _strip_all_preceding_re = re.compile(r"^(\s*\*+)", flags=re.MULTILINE)
+    _preceding_whitespace_re = re.compile(r"^\s*")
 
     def normalize(self, text_block):
 
         # Strip out any preceding [whitespace]* that occur on every line. Not
         # the smartest, but I wonder if I care.
-        check_preceding_re = re.compile(r"^(\s*\*+)")
-        strip_all_preceding_re = re.compile(r"^(\s*\*+)", flags=re.MULTILINE)
-        if check_preceding_re.search(text_block):
-            text_block = strip_all_preceding_re.sub("", text_block)
+        if self._check_preceding_re.search(text_block):
+            text_block = self._strip_all_preceding_re.sub("", text_block)
 
         # Strip consistent indenting by measuring first line's whitespace
         indent_size = None
         lines = text_block.split("\n")
         unindented = []
-        preceding_whitespace_re = re.compile(r"^\s*")
         for line in lines:
-            preceding_whitespace = len(preceding_whitespace_re.search(line).group(0))
+            preceding_whitespace = len(self._preceding_whitespace_re.search(line).group(0))
             if indent_size is None and line.strip() != "":
                 indent_size = preceding_whitespace
             if line == "":
                 line = ""
-            elif (indent_size <= preceding_whitespace) and (indent_size > 0):
+            elif indent_size and indent_size <= preceding_whitespace:
                 line = line[indent_size:]
             unindented.append(line)
 
         return "\n".join(unindented).strip()
-
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent after a StyleGuideBuilder finishes a build.
+# Arguments: metrics, the build's Metrics
+guide_built = Signal()
+
+# Sent after SectionView renders a page.
+# Arguments: metrics, the request's Metrics; position, the section shown
+section_rendered = Signal()
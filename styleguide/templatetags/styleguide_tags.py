@@ -0,0 +1,35 @@
+from django import template
+from styleguide.fragments import fragment_cache
+
+register = template.Library()
+
+
+
+class SectionFragmentNode(template.Node):
+
+    def __init__(self, section):
+        self.section = section
+
+    def render(self, context):
+        section = self.section.resolve(context)
+        stream = context.get('styleguide_stream')
+        if stream is not None:
+            return stream.defer(section, context)
+        return fragment_cache.render(section, context)
+
+
+@register.tag
+def styleguide_section(parser, token):
+    """
+    Renders a section with styleguide/styleguide_section.html, reusing
+    the cached fragment if the section hasn't changed::
+
+        {% styleguide_section section %}
+
+    When the page is streamed, the fragment is rendered as it's sent.
+    """
+
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError("%r takes one argument: a section" % bits[0])
+    return SectionFragmentNode(parser.compile_filter(bits[1]))
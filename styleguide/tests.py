@@ -1,7 +1,38 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
 from django.test import TestCase
+from django.test.client import RequestFactory
+from styleguide.artifact import ArtifactError, load_artifact, write_artifact
+from styleguide.benchmark import CorpusCollector, compare_results, generate_corpus
+from styleguide.builder import BuildError, IncrementalStyleGuideBuilder, StyleGuideBuilder
+from styleguide.cache import CacheGuideStore, FileGuideStore, StyleGuideCache
+from styleguide.collector import CommentCollector, ExampleCollector, FileCollector, \
+    StaticFilesCollector, StorageCollector
+from styleguide.export import StaticSiteExporter
+from styleguide.fragments import FragmentCache, FragmentStream, get_template_source
+from styleguide.parsecache import ParseCache
+from styleguide import renderers
+from styleguide.rendercache import RenderCache
+from styleguide.renderers import render_restructuredtext, render_text
+from styleguide import utils
+from styleguide.utils import LRUCache, atomic_write
+from styleguide.views import SectionView, StreamingHttpResponse
+from styleguide.watcher import GuideWatcher, get_watcher
+
+try:
+    from styleguide.async_views import AsyncSectionView
+except (ImportError, SyntaxError):
+    # Python 2
+    AsyncSectionView = None
 from styleguide.scss import SCSSCommentParser
-from styleguide.models import StyleGuideSection
-from styleguide.kss import KSSDocParser
+from styleguide.models import StyleGuide, StyleGuideModifier, StyleGuideSection
+from styleguide.kss import KSSDocParser, KSSTokenParser, compile_template
 
 
 class KSSDocParserTest(TestCase):
@@ -68,12 +99,12 @@ class KSSDocParserTest(TestCase):
         section = parser.parse_section()
         self.assertEquals(section.title, 'Style guide section title')
         self.assertEquals(section.modifiers,
-                          [{'description': 'Adds brighter highlight.',
-                            'modifier': '.emphasis',
-                            'template': None},
-                           {'description': 'Use for secondary actions.',
-                            'modifier': '.subtle',
-                            'template': None}])
+                          [StyleGuideModifier(description='Adds brighter highlight.',
+                                              modifier='.emphasis',
+                                              template=None),
+                           StyleGuideModifier(description='Use for secondary actions.',
+                                              modifier='.subtle',
+                                              template=None)])
         self.assertEquals(section.position, '1.1')
 
 
@@ -113,17 +144,176 @@ class KSSDocParserTest(TestCase):
         section = parser.parse_section()
         self.assertEquals(section.title, 'Style guide section title')
         self.assertEquals(section.modifiers,
-                          [{'description': 'Adds brighter highlight.',
-                            'modifier': '.emphasis',
-                            'template': '<p class="emphasis">The quick brown fox...</p>\n'},
-                           {'description': 'Use for secondary actions.',
-                            'modifier': '.subtle',
-                            'template': '<p class="subtle">The quick brown fox...</p>\n'}])
+                          [StyleGuideModifier(description='Adds brighter highlight.',
+                                              modifier='.emphasis',
+                                              template='<p class="emphasis">The quick brown fox...</p>\n'),
+                           StyleGuideModifier(description='Use for secondary actions.',
+                                              modifier='.subtle',
+                                              template='<p class="subtle">The quick brown fox...</p>\n')])
         self.assertEquals(section.position, '1.1')
         self.assertEquals(section.template, '<p class="">The quick brown fox...</p>\n')
 
 
 
+# comments parsed by both KSS parsers, down to the odd corners of the format
+KSS_SAMPLES = [
+    "Styleguide 1",
+    """
+        Style guide section title
+
+        Description here.
+
+        More description.
+
+        Styleguide 1.1
+    """,
+    """
+        Style guide section title
+
+        .emphasis - Adds brighter highlight.
+        .subtle - Use for secondary actions.
+
+            <p class="{{ modifier }}">The quick brown fox...</p>
+
+        Styleguide 1.1
+    """,
+    """
+        .first - Modifiers before the title.
+
+        Title
+        Styleguide 2.1
+
+
+        Two blank lines above, three below.
+
+
+
+        The rest - with a dash.
+
+          <div class="{{ modifier }}">
+            <span>Markup</span>
+          </div>
+
+        Not markup, but after it.
+    """,
+    """
+      Title
+
+        .indented - Continued
+          over several
+          lines.
+        .next - Next.
+      not - indented
+
+      Styleguide 3\r
+    """,
+    "\tTitle\n\n\t\n\tDesc\n\tStyleguide 4\n\n",
+    """
+        Escaped
+
+        .a&b - Ampersand.
+        .c<d> - Brackets.
+
+        <a class="{{ modifier }}" title="{{ modifier }}">&amp;</a>
+
+        Styleguide 5
+    """,
+    """
+        Tags and filters
+
+        .upper - Filtered.
+
+        {% if modifier %}<b class="{{ modifier|upper }}"></b>{% endif %}
+
+        Styleguide 6
+    """,
+]
+
+
+def section_state(section):
+    # types too, as templates must stay marked safe
+    return (section.position, section.title, section.desc, section.desc_source,
+            [(m.__getstate__(), type(m.template)) for m in section.modifiers],
+            section.template, type(section.template))
+
+
+
+class KSSTokenParserTest(TestCase):
+
+    def test_same_sections_as_kss_doc_parser(self):
+        corpus = generate_corpus(files=2, sections=5, modifiers=6, comment_style="/*")
+        comments = CorpusCollector(corpus).get_comments_list()
+        for content in KSS_SAMPLES + comments:
+            self.assertEquals(section_state(KSSTokenParser(content).parse_section()),
+                              section_state(KSSDocParser(content).parse_section()))
+
+    def test_invalid_sections(self):
+        for content in ("Title\n\n.a - b - c\n\nStyleguide 1", "<p></p>\nStyleguide 1"):
+            self.assertRaises(Exception, KSSDocParser(content).parse_section)
+            self.assertRaises(Exception, KSSTokenParser(content).parse_section)
+
+    def test_builder_parser_class(self):
+        collector = CorpusCollector(generate_corpus(files=2, sections=3))
+        guide = StyleGuideBuilder(collector, parse_cache=False, workers=0,
+                                  parser_class=KSSTokenParser).get_style_guide()
+        expected = StyleGuideBuilder(collector, parse_cache=False, workers=0).get_style_guide()
+        self.assertEquals([section_state(s) for s in guide.sections],
+                          [section_state(s) for s in expected.sections])
+
+
+
+rendered_sources = []
+
+
+def recording_renderer(source):
+    rendered_sources.append(source)
+    return u"<p>%s</p>" % source
+
+
+
+class RecordingKSSDocParser(KSSDocParser):
+    desc_renderer = staticmethod(recording_renderer)
+
+
+
+class LazyDescriptionTest(TestCase):
+
+    def setUp(self):
+        del rendered_sources[:]
+
+    def test_renders_on_first_access_only(self):
+
+        section = RecordingKSSDocParser("""
+            Title
+
+            Description here.
+
+            Styleguide 1.1
+        """).parse_section()
+        self.assertEquals(rendered_sources, [])
+        self.assertEquals(section.desc, u"<p>Description here.\n</p>")
+        self.assertEquals(section.desc, u"<p>Description here.\n</p>")
+        self.assertEquals(rendered_sources, ["Description here.\n"])
+
+    def test_empty_description_not_rendered(self):
+
+        section = RecordingKSSDocParser("""
+            Title
+            Styleguide 1.1
+        """).parse_section()
+        self.assertEquals(section.desc, u"")
+        self.assertEquals(rendered_sources, [])
+
+
+
+class CompileTemplateTest(TestCase):
+
+    def test_compiles_each_source_once(self):
+        template = compile_template('<p class="{{ modifier }}"></p>')
+        self.assertIs(compile_template('<p class="{{ modifier }}"></p>'), template)
+
+
+
 class StyleGuideSectionTest(TestCase):
 
     def test_order(self):
@@ -139,6 +329,41 @@ class StyleGuideSectionTest(TestCase):
         sort_order = sorted(expected_order, key=lambda section: section.comparable_position())
         self.assertListEqual(sort_order, expected_order)
 
+    def test_sort_key(self):
+
+        self.assertEquals(StyleGuideSection('1.11.','','',None,None).sort_key, (1, 11))
+
+
+
+class StyleGuideTest(TestCase):
+
+    def setUp(self):
+        self.sections = [StyleGuideSection(position, '', '', None, None)
+                         for position in ['1', '1.1', '1.1.1', '1.2', '2', '2.1', '11']]
+        self.guide = StyleGuide("Test", self.sections)
+
+    def positions(self, sections):
+        return [s.position for s in sections]
+
+    def test_get_sections(self):
+        self.assertEquals(self.positions(self.guide.get_sections("1")),
+                          ['1', '1.1', '1.1.1', '1.2'])
+        self.assertEquals(self.positions(self.guide.get_sections("1.1.")),
+                          ['1.1', '1.1.1'])
+        self.assertEquals(self.positions(self.guide.get_sections("3")), [])
+        self.assertEquals(self.guide.get_sections(), self.sections)
+
+    def test_get_root_sections(self):
+        self.assertEquals(self.positions(self.guide.get_root_sections()),
+                          ['1', '2', '11'])
+
+    def test_navigation(self):
+        section = self.guide.get_section("1.1")
+        self.assertEquals(section.depth(), 1)
+        self.assertEquals(self.guide.get_parent(section).position, '1')
+        self.assertEquals(self.positions(self.guide.get_children(section)), ['1.1.1'])
+        self.assertIsNone(self.guide.get_parent(self.guide.get_section("1")))
+
 
 
 class SCSSCommentParserTest(TestCase):
@@ -236,3 +461,1087 @@ Indented comments:
         blocks = self.parser.blocks()
         self.assertIn("Indented single-line comment.", blocks)
         self.assertIn("Indented block comment.", blocks)
+
+    def test_streams_file_objects(self):
+        source = io.BytesIO((self.source + u"\n// caf\xe9\n").encode('utf-8'))
+        parser = SCSSCommentParser(source)
+        # splits lines, and multibyte characters, across chunks
+        parser.chunk_size = 7
+        self.assertEquals(parser.blocks(),
+                          SCSSCommentParser(self.source + u"\n// caf\xe9\n").blocks())
+
+    def test_streams_lines(self):
+        lines = [line + u"\n" for line in self.source.split(u"\n")]
+        self.assertEquals(list(SCSSCommentParser(iter(lines)).iter_blocks()),
+                          self.parser.blocks())
+
+    def test_decodes_bytes(self):
+        source = u"// Caf\xe9\n//\n// Styleguide 1\n"
+        self.assertEquals(SCSSCommentParser(source.encode('utf-8')).blocks(),
+                          SCSSCommentParser(source).blocks())
+
+    def test_streams_lines_without_newlines(self):
+        source = u"// A\n//\n// Styleguide 1\n.a {}\n/* B\n\nStyleguide 2 */\n"
+        expected = SCSSCommentParser(source).blocks()
+        self.assertEquals(len(expected), 2)
+        self.assertEquals(list(SCSSCommentParser(iter(source.splitlines())).iter_blocks()),
+                          expected)
+        self.assertEquals(SCSSCommentParser(source.splitlines()).blocks(), expected)
+        self.assertEquals(SCSSCommentParser(source.encode('utf-8').splitlines(True)).blocks(),
+                          expected)
+
+
+
+class CountingCollector(ExampleCollector):
+
+    def __init__(self):
+        self.fingerprint = ("v1",)
+        self.collections = 0
+
+    def get_comments_list(self):
+        self.collections += 1
+        return super(CountingCollector, self).get_comments_list()
+
+    def get_fingerprint(self):
+        return self.fingerprint
+
+
+
+class StyleGuideCacheTest(TestCase):
+
+    def setUp(self):
+        self.collector = CountingCollector()
+
+    def test_reuses_guide_while_fingerprint_unchanged(self):
+        cache = StyleGuideCache(enabled=True)
+        guide = cache.get_style_guide(self.collector)
+        self.assertIs(cache.get_style_guide(self.collector), guide)
+        self.assertEquals(self.collector.collections, 1)
+
+    def test_rebuilds_when_fingerprint_changes(self):
+        cache = StyleGuideCache(enabled=True)
+        guide = cache.get_style_guide(self.collector)
+        self.collector.fingerprint = ("v2",)
+        self.assertIsNot(cache.get_style_guide(self.collector), guide)
+        self.assertEquals(self.collector.collections, 2)
+
+    def test_invalidate(self):
+        cache = StyleGuideCache(enabled=True)
+        cache.get_style_guide(self.collector)
+        cache.invalidate()
+        cache.get_style_guide(self.collector)
+        self.assertEquals(self.collector.collections, 2)
+
+    def test_disabled(self):
+        cache = StyleGuideCache(enabled=False)
+        cache.get_style_guide(self.collector)
+        cache.get_style_guide(self.collector)
+        self.assertEquals(self.collector.collections, 2)
+
+
+
+class SourcesCollector(CommentCollector):
+    """
+    Collects comments from a dict of source names to contents.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.reads = []
+
+    def get_sources(self):
+        return sorted(self.sources)
+
+    def get_source_stamp(self, name):
+        return self.sources[name]
+
+    def read_source(self, name):
+        self.reads.append(name)
+        return self.sources[name]
+
+    def get_comments_list(self):
+        out = []
+        for name in self.get_sources():
+            out.extend(self.get_source_comments(name, self.read_source(name)))
+        return out
+
+
+
+class ParseCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_builder_reuses_cached_sections(self):
+        collector = SourcesCollector({
+            "a.scss": "// Buttons\n//\n// Styleguide 1\n",
+            "b.scss": "// Links\n//\n// Styleguide 2\n",
+        })
+        cache = ParseCache(self.directory)
+        StyleGuideBuilder(collector, parse_cache=cache).get_style_guide()
+        self.assertEquals(len(os.listdir(self.directory)), 2)
+
+        # cached entries are used instead of parsing again
+        builder = StyleGuideBuilder(collector, parse_cache=cache)
+        builder.parse_comments = None
+        guide = builder.get_style_guide()
+        self.assertEquals([s.title for s in guide.sections], ["Buttons", "Links"])
+
+    def test_get_missing(self):
+        cache = ParseCache(self.directory)
+        self.assertIsNone(cache.get(cache.get_key("nothing")))
+
+    def test_prune_evicts_other_versions(self):
+        old_cache = ParseCache(self.directory, version="0.0")
+        old_cache.set(old_cache.get_key("a"), [])
+        cache = ParseCache(self.directory)
+        cache.set(cache.get_key("a"), [])
+        cache.prune()
+        self.assertEquals(os.listdir(self.directory),
+                          [os.path.basename(cache.get_path(cache.get_key("a")))])
+
+    def test_prune_evicts_least_recently_used(self):
+        cache = ParseCache(self.directory)
+        for i, contents in enumerate(["a", "b", "c"]):
+            key = cache.get_key(contents)
+            cache.set(key, [])
+            os.utime(cache.get_path(key), (i, i))
+        cache.max_size = os.path.getsize(cache.get_path(key)) * 2
+        cache.prune()
+        self.assertIsNone(cache.get(cache.get_key("a")))
+        self.assertIsNotNone(cache.get(cache.get_key("c")))
+
+
+
+class IncrementalStyleGuideBuilderTest(TestCase):
+
+    def setUp(self):
+        self.collector = SourcesCollector({
+            "a.scss": "// A\n//\n// Styleguide 1\n\n// A.2\n//\n// Styleguide 1.2\n",
+            "b.scss": "// B\n//\n// Styleguide 2\n",
+            "c.scss": "// A.1\n//\n// Styleguide 1.1\n",
+        })
+        self.builder = IncrementalStyleGuideBuilder(self.collector)
+        self.guide = self.builder.get_style_guide()
+
+    def positions(self, guide):
+        return [s.position for s in guide.sections]
+
+    def test_full_build(self):
+        self.assertEquals(self.positions(self.guide), ["1", "1.1", "1.2", "2"])
+
+    def test_unchanged(self):
+        self.collector.reads = []
+        self.assertIs(self.builder.get_style_guide(), self.guide)
+        self.assertEquals(self.collector.reads, [])
+
+    def test_reparses_changed_source_only(self):
+        self.collector.reads = []
+        self.collector.sources["c.scss"] = "// A.3\n//\n// Styleguide 1.3\n"
+        guide = self.builder.get_style_guide()
+        self.assertEquals(self.collector.reads, ["c.scss"])
+        self.assertEquals(self.positions(guide), ["1", "1.2", "1.3", "2"])
+        # the previous guide is left untouched
+        self.assertEquals(self.positions(self.guide), ["1", "1.1", "1.2", "2"])
+
+    def test_added_and_removed_sources(self):
+        del self.collector.sources["a.scss"]
+        self.collector.sources["d.scss"] = "// C\n//\n// Styleguide 3\n"
+        guide = self.builder.get_style_guide()
+        self.assertEquals(self.positions(guide), ["1.1", "2", "3"])
+
+    def test_broken_edit_does_not_fail_the_guide(self):
+        self.collector.sources["b.scss"] = ("// B\n//\n// .mod - Modifier\n//\n"
+                                            "//     <div>{% bogus %}</div>\n//\n"
+                                            "// Styleguide 2\n")
+        guide = self.builder.get_style_guide()
+        self.assertEquals(self.positions(guide), ["1", "1.1", "1.2"])
+        self.assertEquals(self.builder.metrics.counters['parse_errors'], 1)
+
+    def test_first_build_fails_when_every_section_fails(self):
+        collector = SourcesCollector({
+            "a.scss": "// A\n//\n// .mod - Modifier\n//\n//     <div>{% bogus %}</div>\n//\n"
+                      "// Styleguide 1\n",
+        })
+        builder = IncrementalStyleGuideBuilder(collector, parse_cache=False)
+        self.assertRaises(BuildError, builder.get_style_guide)
+
+    def test_failed_update_is_retried(self):
+        read_source = self.collector.read_source
+
+        def broken_read_source(name):
+            raise RuntimeError("unreadable")
+
+        self.collector.sources["b.scss"] = "// B broken\n//\n// Styleguide 2\n"
+        self.collector.read_source = broken_read_source
+        self.assertRaises(RuntimeError, self.builder.get_style_guide)
+
+        self.collector.read_source = read_source
+        self.collector.sources["b.scss"] = "// B fixed\n//\n// Styleguide 2\n"
+        guide = self.builder.get_style_guide()
+        self.assertEquals([(s.position, s.title) for s in guide.sections],
+                          [("1", "A"), ("1.1", "A.1"), ("1.2", "A.2"), ("2", "B fixed")])
+
+
+
+class GuideWatcherTest(TestCase):
+
+    def wait_for(self, condition, attempts=200):
+        import time
+        for _ in range(attempts):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_rebuilds_in_background(self):
+        collector = SourcesCollector({"a.scss": "// A\n//\n// Styleguide 1\n"})
+        collector.get_fingerprint = lambda: tuple(sorted(collector.sources.items()))
+        watcher = GuideWatcher(collector, interval=0.01, use_inotify=False)
+        watcher.start()
+        try:
+            fingerprint, guide = watcher.get_entry()
+            self.assertEquals([s.position for s in guide.sections], ["1"])
+
+            collector.sources["b.scss"] = "// B\n//\n// Styleguide 2\n"
+            self.assertTrue(self.wait_for(lambda: watcher.get_entry()[1] is not guide))
+            self.assertEquals([s.position for s in watcher.get_style_guide().sections],
+                              ["1", "2"])
+
+            # a failed rebuild keeps serving the last good guide
+            good = watcher.get_entry()
+
+            def read_source(name):
+                raise RuntimeError("unreadable")
+
+            collector.read_source = read_source
+            collector.sources["c.scss"] = "// C\n//\n// Styleguide 3\n"
+            self.assertFalse(self.wait_for(lambda: watcher.get_entry() is not good, attempts=20))
+        finally:
+            watcher.stop()
+
+    def test_one_watcher_per_collector(self):
+        one = SourcesCollector({"a.scss": "// A\n//\n// Styleguide 1\n"})
+        two = SourcesCollector({"b.scss": "// B\n//\n// Styleguide 2\n"})
+        one.get_cache_key = lambda: "one"
+        two.get_cache_key = lambda: "two"
+        try:
+            self.assertIs(get_watcher(one), get_watcher(one))
+            self.assertIsNot(get_watcher(one), get_watcher(two))
+            self.assertEquals([s.position for s in get_watcher(two).get_style_guide().sections],
+                              ["2"])
+        finally:
+            from styleguide.watcher import _watchers
+            for key in ("one", "two"):
+                _watchers.pop(key).stop()
+
+    def test_broken_section_is_skipped(self):
+        collector = SourcesCollector({
+            "a.scss": "// A\n//\n// .mod - Modifier\n//\n//     <div>{% bogus %}</div>\n//\n"
+                      "// Styleguide 1\n\n// B\n//\n// Styleguide 2\n",
+        })
+        builder = StyleGuideBuilder(collector, parse_cache=False, workers=0)
+        guide = builder.get_style_guide()
+        self.assertEquals([s.position for s in guide.sections], ["2"])
+        self.assertEquals(builder.metrics.counters['parse_errors'], 1)
+
+
+
+class ParallelStyleGuideBuilderTest(TestCase):
+
+    def test_same_guide_as_serial_build(self):
+        sources = {}
+        for i in range(1, 9):
+            sources["%d.scss" % i] = "".join(
+                "// Section %d.%d\n//\n// Styleguide %d.%d\n\n" % (i, j, 9 - i, j)
+                for j in range(1, 4))
+        collector = SourcesCollector(sources)
+
+        serial = StyleGuideBuilder(collector, workers=0).get_style_guide()
+        parallel = StyleGuideBuilder(collector, workers=3).get_style_guide()
+        self.assertEquals([(s.position, s.title) for s in parallel.sections],
+                          [(s.position, s.title) for s in serial.sections])
+
+    def test_comments_without_sources(self):
+        serial = StyleGuideBuilder(ExampleCollector(), workers=0).get_style_guide()
+        parallel = StyleGuideBuilder(ExampleCollector(), workers=2).get_style_guide()
+        self.assertEquals([s.position for s in parallel.sections],
+                          [s.position for s in serial.sections])
+
+    @unittest.skipIf(sys.version_info < (3, 7), "workers are always forked")
+    def test_spawned_workers(self):
+        import multiprocessing
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method("spawn", force=True)
+        try:
+            guide = StyleGuideBuilder(ExampleCollector(), workers=2).get_style_guide()
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        self.assertEquals([s.position for s in guide.sections], ["1", "1.1", "1.2", "1.3"])
+
+    def test_fails_when_every_section_fails(self):
+        collector = SourcesCollector({
+            "a.scss": "// A\n//\n// .mod - Modifier\n//\n//     <div>{% bogus %}</div>\n//\n"
+                      "// Styleguide 1\n",
+        })
+        self.assertRaises(BuildError, StyleGuideBuilder(collector, parse_cache=False,
+                                                        workers=0).get_style_guide)
+
+
+
+class FileCollectorPrefilterTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, contents):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_reads_files_with_sections(self):
+        path = self.write("a.scss", b"// Buttons\n//\n// Styleguide 1\n")
+        collector = FileCollector(prefilter=True)
+        self.assertEquals(collector.read_source(path),
+                          u"// Buttons\n//\n// Styleguide 1\n")
+        self.assertEquals(collector.get_stats()['files_skipped'], 0)
+
+    def test_skips_files_without_sections(self):
+        vendor = self.write("vendor.css", b".a{color:red}/* vendor */")
+        empty = self.write("empty.css", b"")
+        collector = FileCollector(prefilter=True)
+        self.assertEquals(collector.read_source(vendor), u"")
+        self.assertEquals(collector.read_source(empty), u"")
+        self.assertEquals(collector.get_stats(),
+                          {'files_read': 0, 'bytes_read': 0,
+                           'files_skipped': 2, 'bytes_skipped': 25,
+                           'files_duplicate': 0})
+
+    def test_disabled(self):
+        vendor = self.write("vendor.css", b".a{color:red}")
+        collector = FileCollector(prefilter=False)
+        self.assertEquals(collector.read_source(vendor), u".a{color:red}")
+
+    def test_streams_large_files(self):
+        self.write("a.scss", b"// Buttons\n//\n// Styleguide 1\n.a{}\n/* B\n\nStyleguide 2 */\n")
+        self.write("vendor.css", b".a{color:red}/* vendor */")
+        streamed = FileCollector(roots=[self.directory], stream_size=0)
+        read = FileCollector(roots=[self.directory])
+        self.assertEquals(streamed.get_comments_list(), read.get_comments_list())
+        self.assertEquals(streamed.get_stats(), read.get_stats())
+        self.assertIsNone(read.stream_source_comments(os.path.join(self.directory, "a.scss")))
+        guide = StyleGuideBuilder(FileCollector(roots=[self.directory], stream_size=0),
+                                  parse_cache=False, workers=0).get_style_guide()
+        self.assertEquals([section.position for section in guide.sections], ['1', '2'])
+
+
+
+class TemporaryFilesMixin(object):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, relpath, contents=b"// A\n//\n// Styleguide 1\n"):
+        path = os.path.join(self.directory, *relpath.split("/"))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def relpaths(self, filepaths):
+        return sorted(os.path.relpath(path, self.directory).replace(os.sep, "/")
+                      for path in filepaths)
+
+
+
+class FileCollectorDiscoveryTest(TemporaryFilesMixin, TestCase):
+
+    def test_include_and_exclude(self):
+        self.write("css/site.scss")
+        self.write("css/site.js")
+        self.write("css/vendor/lib.css", b"/* lib */")
+        self.write("admin/css/base.css", b"/* admin */")
+        self.write("node_modules/pkg/pkg.css", b"/* pkg */")
+        self.write(".cache/site.css", b"/* cache */")
+        collector = FileCollector(roots=[self.directory], exclude=("admin", ".*", "node_modules"))
+        self.assertEquals(self.relpaths(collector.iterate_matching_files()),
+                          ["css/site.scss", "css/vendor/lib.css"])
+
+        collector = FileCollector(roots=[self.directory], include=("css/*.scss",),
+                                  exclude=("admin", "node_modules"))
+        self.assertEquals(self.relpaths(collector.iterate_matching_files()),
+                          ["css/site.scss"])
+
+    def test_multiple_roots(self):
+        self.write("one/a.scss")
+        self.write("two/b.scss", b"// B\n//\n// Styleguide 2\n")
+        roots = [os.path.join(self.directory, "two"), os.path.join(self.directory, "one")]
+        collector = FileCollector(roots=roots)
+        self.assertEquals(self.relpaths(collector.get_sources()), ["one/a.scss", "two/b.scss"])
+
+    def test_removes_duplicates(self):
+        self.write("css/site.css")
+        self.write("css/site.55e7cbb9ba48.css")
+        self.write("css/other.css", b"// B\n//\n// Styleguide 2\n")
+        collector = FileCollector(roots=[self.directory])
+        self.assertEquals(self.relpaths(collector.get_sources()),
+                          ["css/other.css", "css/site.css"])
+        self.assertEquals(collector.get_stats()['files_duplicate'], 1)
+
+    def test_last_modified_moves_forward_on_removal(self):
+        self.write("css/a.scss")
+        self.write("css/b.scss", b"// B\n//\n// Styleguide 2\n")
+        for relpath in ("css/a.scss", "css/b.scss", "css", ""):
+            path = os.path.join(self.directory, relpath)
+            os.utime(path, (1000000000, 1000000000))
+        collector = FileCollector(roots=[self.directory])
+        fingerprint = collector.get_fingerprint()
+        last_modified = collector.get_last_modified(fingerprint)
+
+        os.remove(os.path.join(self.directory, "css", "b.scss"))
+        removed = collector.get_fingerprint()
+        self.assertNotEquals(removed, fingerprint)
+        self.assertTrue(collector.get_last_modified(removed) > last_modified)
+
+    def test_collectors_with_other_roots_are_cached_apart(self):
+        self.write("one/a.scss")
+        self.write("two/b.scss", b"// B\n//\n// Styleguide 2\n")
+        one = FileCollector(roots=[os.path.join(self.directory, "one")])
+        two = FileCollector(roots=[os.path.join(self.directory, "two")])
+        self.assertNotEquals(one.get_cache_key(), two.get_cache_key())
+        self.assertEquals(one.get_cache_key(),
+                          FileCollector(roots=[os.path.join(self.directory, "one")])
+                          .get_cache_key())
+
+        cache = StyleGuideCache(enabled=True)
+        for _ in range(3):
+            self.assertEquals([s.position for s in cache.get_style_guide(one).sections], ["1"])
+            self.assertEquals([s.position for s in cache.get_style_guide(two).sections], ["2"])
+        self.assertEquals(cache.stats['builds'], 2)
+
+
+
+class SharedStyleGuideCacheTest(TemporaryFilesMixin, TestCase):
+
+    def setUp(self):
+        super(SharedStyleGuideCacheTest, self).setUp()
+        self.collector = CountingCollector()
+
+    def get_stores(self):
+        return [FileGuideStore(self.directory),
+                CacheGuideStore('default', key_prefix="test-guide-%s" % id(self))]
+
+    def test_builds_once_across_processes(self):
+        for store in self.get_stores():
+            self.collector.collections = 0
+            first = StyleGuideCache(enabled=True, store=store)
+            second = StyleGuideCache(enabled=True, store=store)
+            guide = first.get_style_guide(self.collector)
+            shared = second.get_style_guide(self.collector)
+            self.assertEquals([s.position for s in shared.sections],
+                              [s.position for s in guide.sections])
+            self.assertEquals(self.collector.collections, 1)
+            self.assertEquals(second.stats['shared_hits'], 1)
+
+    def test_serves_previous_guide_while_locked(self):
+        for store in self.get_stores():
+            cache = StyleGuideCache(enabled=True, store=store)
+            self.collector.fingerprint = ("v1", id(store))
+            guide = cache.get_style_guide(self.collector)
+
+            self.collector.fingerprint = ("v2", id(store))
+            lock = store.acquire(cache.get_cache_key(self.collector), self.collector.fingerprint)
+            try:
+                self.assertEquals(cache.get_entry(self.collector),
+                                  (("v1", id(store)), guide))
+            finally:
+                store.release(lock)
+            self.assertEquals(cache.stats['lock_contention'], 1)
+            self.assertEquals(cache.stats['stale_served'], 1)
+            self.assertIsNot(cache.get_style_guide(self.collector), guide)
+
+    def test_waits_without_previous_guide(self):
+        store = self.get_stores()[0]
+        cache = StyleGuideCache(enabled=True, store=store, wait=0.1)
+        lock = store.acquire(cache.get_cache_key(self.collector), self.collector.fingerprint)
+        try:
+            cache.get_style_guide(self.collector)
+        finally:
+            store.release(lock)
+        # built here once the wait timed out
+        self.assertEquals(cache.stats['builds'], 1)
+        self.assertTrue(cache.stats['wait_time'] >= 0.1)
+
+    def test_release_keeps_lock_taken_after_expiry(self):
+        from django.core.cache import cache
+        store = CacheGuideStore('default', key_prefix="test-guide-%s" % id(self))
+        lock = store.acquire("key", ("v1",))
+        self.assertIsNone(store.acquire("key", ("v1",)))
+        # expired, and taken by another process
+        cache.set(lock[0], "other")
+        store.release(lock)
+        self.assertEquals(cache.get(lock[0]), "other")
+        cache.delete(lock[0])
+
+    def test_does_not_share_guides_over_max_size(self):
+        store = CacheGuideStore('default', key_prefix="test-guide-%s" % id(self),
+                                max_size=50)
+        store.set("key", ("v1",), ["x" * 100])
+        self.assertIsNone(store.get("key", ("v1",)))
+        store.set("key", ("v1",), ["x"])
+        self.assertEquals(store.get("key", ("v1",)), ["x"])
+
+    def test_publishing_keeps_newer_guides_and_locks(self):
+        store = FileGuideStore(self.directory)
+        store.set("key", ("v1",), [1])
+        os.utime(store.get_path("key", ("v1",), ".guide"), (time.time() - 10,) * 2)
+        store.set("key", ("v2",), [2])
+        self.assertIsNone(store.get("key", ("v1",)))
+
+        # an older build finishing late doesn't remove the newer guide,
+        # nor the lock of a build in progress
+        os.utime(store.get_path("key", ("v2",), ".guide"), (time.time() + 10,) * 2)
+        lock = store.acquire("key", ("v3",))
+        try:
+            store.set("key", ("v1",), [1])
+            self.assertEquals(store.get("key", ("v2",)), [2])
+            self.assertIsNone(store.acquire("key", ("v3",)))
+        finally:
+            store.release(lock)
+
+
+
+def get_remote_storage(location):
+    import datetime
+    from django.core.files import File
+    from django.core.files.storage import FileSystemStorage
+
+    class RemoteStorage(FileSystemStorage):
+        """
+        FileSystemStorage that hides its local paths, like a remote storage.
+        """
+
+        def path(self, name):
+            raise NotImplementedError()
+
+        def local_path(self, name):
+            return os.path.join(location, name)
+
+        def _open(self, name, mode='rb'):
+            return File(open(self.local_path(name), mode))
+
+        def listdir(self, path):
+            names = os.listdir(self.local_path(path))
+            return ([n for n in names if os.path.isdir(self.local_path(os.path.join(path, n)))],
+                    [n for n in names if os.path.isfile(self.local_path(os.path.join(path, n)))])
+
+        def size(self, name):
+            return os.path.getsize(self.local_path(name))
+
+        def modified_time(self, name):
+            return datetime.datetime.fromtimestamp(os.path.getmtime(self.local_path(name)))
+
+        get_modified_time = modified_time
+
+    return RemoteStorage(location=location)
+
+
+def clear_finders():
+    from django.contrib.staticfiles import finders
+    if hasattr(finders.get_finder, 'cache_clear'):
+        finders.get_finder.cache_clear()
+    else:
+        # Django < 1.7 memoizes finders in a dict
+        finders._finders.clear()
+
+
+class StorageCollectorTest(TemporaryFilesMixin, TestCase):
+
+    def get_storage(self):
+        from django.core.files.storage import FileSystemStorage
+        return FileSystemStorage(location=self.directory)
+
+    def test_local_storage(self):
+        self.write("css/site.scss")
+        self.write("css/site.js")
+        self.write("node_modules/pkg/pkg.css")
+        collector = StorageCollector(self.get_storage())
+        self.assertEquals(collector.get_sources(), ["css/site.scss"])
+        self.assertEquals(collector.read_source("css/site.scss"),
+                          u"// A\n//\n// Styleguide 1\n")
+        self.assertEquals(collector.get_fingerprint()[0][0], "css/site.scss")
+        self.assertRaises(IOError, collector.read_source, "css/missing.scss")
+
+    def test_remote_storage(self):
+        self.write("site.scss")
+        collector = StorageCollector(get_remote_storage(self.directory))
+        self.assertEquals(collector.read_source("site.scss"), u"// A\n//\n// Styleguide 1\n")
+        mtime, size = collector.get_source_stamp("site.scss")
+        self.assertEquals(size, 24)
+
+    def test_pickles_without_storages(self):
+        import pickle
+        self.write("site.scss")
+        collector = StorageCollector(self.get_storage())
+        collector.get_sources()
+        copy = pickle.loads(pickle.dumps(collector))
+        self.assertEquals(copy.read_source("site.scss"), u"// A\n//\n// Styleguide 1\n")
+
+    def test_static_files_finders(self):
+        from django.test.utils import override_settings
+        self.write("one/css/site.scss")
+        self.write("two/css/site.scss", b"// B\n//\n// Styleguide 2\n")
+        self.write("two/css/other.scss", b"// C\n//\n// Styleguide 3\n")
+        dirs = [os.path.join(self.directory, "one"), ("lib", os.path.join(self.directory, "two"))]
+        with override_settings(STATICFILES_DIRS=dirs,
+                               STATICFILES_FINDERS=('django.contrib.staticfiles.finders.FileSystemFinder',)):
+            clear_finders()
+            try:
+                collector = StaticFilesCollector()
+                self.assertEquals(collector.get_sources(),
+                                  ["css/site.scss", "lib/css/other.scss", "lib/css/site.scss"])
+                self.assertEquals(collector.read_source("lib/css/site.scss"),
+                                  u"// B\n//\n// Styleguide 2\n")
+            finally:
+                clear_finders()
+
+
+
+class AtomicWriteTest(TemporaryFilesMixin, TestCase):
+
+    def mode(self, path):
+        return os.stat(path).st_mode & 0o777
+
+    def test_new_files_follow_umask(self):
+        path = os.path.join(self.directory, "new.html")
+        atomic_write(path, b"new")
+        self.assertEquals(self.mode(path), 0o666 & ~utils._umask)
+
+    def test_keeps_mode_of_replaced_file(self):
+        path = self.write("page.html", b"old")
+        os.chmod(path, 0o640)
+        atomic_write(path, b"new")
+        self.assertEquals(self.mode(path), 0o640)
+
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEquals(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEquals(len(cache), 2)
+
+
+
+class RenderCacheTest(TestCase):
+
+    def setUp(self):
+        del rendered_sources[:]
+
+    def test_memoizes_by_source_and_settings(self):
+        cache = RenderCache(size=10, alias=None)
+        cache.render("a", recording_renderer, "x")
+        cache.render("a", recording_renderer, "x")
+        cache.render("a", recording_renderer, "y")
+        self.assertEquals(rendered_sources, ["a", "a"])
+        stats = cache.get_stats()
+        self.assertEquals((stats['hits'], stats['misses']), (1, 2))
+
+    def test_shared_cache(self):
+        cache = RenderCache(size=10, alias='default', key_prefix="test-desc")
+        cache.render("b", recording_renderer, "x")
+
+        other_worker = RenderCache(size=10, alias='default', key_prefix="test-desc")
+        self.assertEquals(other_worker.render("b", recording_renderer, "x"), u"<p>b</p>")
+        self.assertEquals(rendered_sources, ["b"])
+        self.assertEquals(other_worker.get_stats()['shared_hits'], 1)
+
+
+
+class DescriptionRendererTest(TestCase):
+
+    def tearDown(self):
+        renderers._default_renderer = None
+
+    def test_render_text(self):
+        html = render_text(u"A *fine* <b>button</b>,\nwith ``.btn &amp``.\n\n  **Bold** ends.\n")
+        self.assertEquals(html, u"<p>A <em>fine</em> &lt;b&gt;button&lt;/b&gt;,\n"
+                                u"with <code>.btn &amp;amp</code>.</p>\n"
+                                u"<p><strong>Bold</strong> ends.</p>\n")
+        self.assertEquals(render_text(u"2 * 3 * 4"), u"<p>2 * 3 * 4</p>\n")
+
+    def test_cached_per_renderer(self):
+        self.assertEquals(render_text(u"Use ``.btn``."), u"<p>Use <code>.btn</code>.</p>\n")
+        self.assertNotIn(u"<code>.btn</code>", render_restructuredtext(u"Use ``.btn``."))
+
+    def test_default_renderer_setting(self):
+        renderers.DESC_RENDERER = 'styleguide.renderers.render_text'
+        try:
+            section = KSSDocParser("""
+                Title
+
+                Description with *emphasis*.
+
+                Styleguide 1.1
+            """).parse_section()
+        finally:
+            renderers.DESC_RENDERER = 'styleguide.renderers.render_restructuredtext'
+        self.assertIs(section.desc_renderer, render_text)
+        self.assertEquals(section.desc, u"<p>Description with <em>emphasis</em>.</p>\n")
+
+    def test_parse_cache_keyed_by_renderer(self):
+        cache = ParseCache(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, cache.directory)
+        self.assertNotEqual(cache.get_key("a", "styleguide.renderers.render_text"),
+                            cache.get_key("a", "styleguide.renderers.render_restructuredtext"))
+
+    def test_docutils_imported_lazily(self):
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys, styleguide.builder; print('docutils' in sys.modules)"])
+        self.assertEquals(output.strip(), b"False")
+
+
+
+class StaticSiteExporterTest(TestCase):
+    urls = 'styleguide.urls'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.guide = StyleGuideBuilder(ExampleCollector()).get_style_guide()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_writes_changed_pages_only(self):
+        exporter = StaticSiteExporter(self.directory, workers=0, gzip=True)
+        page = exporter.get_page_path("1")
+        self.assertEquals(exporter.export(self.guide), [page])
+        self.assertTrue(os.path.exists(page + ".gz"))
+        with open(page, 'rb') as f:
+            self.assertIn(b"Example style guide", f.read())
+
+        self.assertEquals(exporter.export(self.guide), [])
+
+
+
+class ArtifactTest(TemporaryFilesMixin, TestCase):
+
+    def setUp(self):
+        super(ArtifactTest, self).setUp()
+        self.guide = StyleGuideBuilder(ExampleCollector(), parse_cache=False).get_style_guide()
+        self.path = os.path.join(self.directory, "guide.artifact")
+        write_artifact(self.guide, self.path)
+
+    def state(self, guide):
+        return [(s.position, s.title, s.desc, s.modifiers, s.template) for s in guide.sections]
+
+    def test_round_trip(self):
+        loaded = load_artifact(self.path)
+        self.assertEquals(loaded.title, self.guide.title)
+        self.assertEquals(self.state(loaded), self.state(self.guide))
+
+    def test_descriptions_are_lazy(self):
+        import pickle
+        section = load_artifact(self.path).get_section("1.1")
+        self.assertIsNone(section._desc)
+        self.assertIn(u"<p>", section.desc)
+        copy = pickle.loads(pickle.dumps(load_artifact(self.path).get_section("1.1")))
+        self.assertEquals(copy.desc, section.desc)
+
+    def test_rejects_other_files(self):
+        path = self.write("other.artifact", b"not an artifact at all")
+        self.assertRaises(ArtifactError, load_artifact, path)
+
+    def test_section_view(self):
+        from styleguide.cache import invalidate
+        invalidate()
+        CountingSectionView.counting_collector = CountingCollector()
+        view = CountingSectionView.as_view(artifact=self.path)
+        response = view(RequestFactory().get("/section/1/"), position="1")
+        self.assertIn(b"Example style guide", response.content)
+        self.assertEquals(CountingSectionView.counting_collector.collections, 0)
+
+
+
+class CountingSectionView(SectionView):
+
+    def get_collector(self):
+        return self.counting_collector
+
+
+
+class ConditionalSectionViewTest(TestCase):
+    urls = 'styleguide.urls'
+
+    def setUp(self):
+        from styleguide.cache import invalidate
+        invalidate()
+        CountingSectionView.counting_collector = CountingCollector()
+        self.view = CountingSectionView.as_view()
+        self.factory = RequestFactory()
+
+    def test_not_modified(self):
+        response = self.view(self.factory.get("/section/1/"), position="1")
+        response.render()
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+        collections = CountingSectionView.counting_collector.collections
+
+        response = self.view(self.factory.get("/section/1/", HTTP_IF_NONE_MATCH=etag),
+                             position="1")
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(CountingSectionView.counting_collector.collections, collections)
+
+    def test_etag_changes_with_sources_and_position(self):
+        etag = self.view(self.factory.get("/section/1/"), position="1")['ETag']
+        other_position = self.view(self.factory.get("/section/2/"), position="2")['ETag']
+        CountingSectionView.counting_collector.fingerprint = ("v2",)
+        other_sources = self.view(self.factory.get("/section/1/"), position="1")['ETag']
+        self.assertEquals(len(set([etag, other_position, other_sources])), 3)
+
+
+
+class StreamingTest(TestCase):
+
+    def setUp(self):
+        from styleguide.cache import invalidate
+        invalidate()
+        CountingSectionView.counting_collector = CountingCollector()
+
+    def test_stream_matches_page(self):
+        from django.template import Context, Template
+        template = Template('{% load styleguide_tags %}<div>{% for section in sections %}'
+                            '{% styleguide_section section %}{% endfor %}</div>')
+        sections = [StyleGuideSection('1.%d' % i, 'Title %d' % i, u'<p>Desc</p>', [], None)
+                    for i in range(3)]
+        page = template.render(Context({'sections': sections}))
+
+        stream = FragmentStream(FragmentCache(alias=None))
+        marked = template.render(Context({'sections': sections, 'styleguide_stream': stream}))
+        self.assertNotIn('Title', marked)
+        pieces = list(stream.iter_page(marked))
+        self.assertEquals(len(pieces), 5)
+        self.assertEquals(u"".join(pieces), page)
+
+    @unittest.skipIf(StreamingHttpResponse is None, "needs Django >= 1.5")
+    def test_streaming_view(self):
+        factory = RequestFactory()
+        response = CountingSectionView.as_view()(factory.get("/section/1/"), position="1")
+        streamed = CountingSectionView.as_view(streaming=True)(factory.get("/section/1/"),
+                                                               position="1")
+        self.assertTrue(streamed.streaming)
+        self.assertEquals(b"".join(streamed.streaming_content), response.content)
+        self.assertEquals(streamed['ETag'], response['ETag'])
+
+
+
+def async_views_supported():
+    import django
+    return AsyncSectionView is not None and django.VERSION >= (4, 1)
+
+
+class CountingAsyncSectionView(AsyncSectionView or object):
+
+    def get_collector(self):
+        return CountingSectionView.counting_collector
+
+
+@unittest.skipIf(not async_views_supported(), "needs Python 3 and Django >= 4.1")
+class AsyncSectionViewTest(TestCase):
+
+    def setUp(self):
+        from styleguide.cache import invalidate
+        invalidate()
+        CountingSectionView.counting_collector = CountingCollector()
+        self.view = CountingAsyncSectionView.as_view()
+        self.factory = RequestFactory()
+
+    def run_views(self, *requests):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(asyncio.gather(
+                *[self.view(request, position="1") for request in requests]))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_concurrent_requests_share_build(self):
+        responses = self.run_views(*[self.factory.get("/section/1/") for _ in range(4)])
+        self.assertEquals([r.status_code for r in responses], [200] * 4)
+        self.assertEquals(len(set(r.content for r in responses)), 1)
+        self.assertEquals(CountingSectionView.counting_collector.collections, 1)
+
+    def test_not_modified(self):
+        response, = self.run_views(self.factory.get("/section/1/"))
+        request = self.factory.get("/section/1/", HTTP_IF_NONE_MATCH=response['ETag'])
+        response, = self.run_views(request)
+        self.assertEquals(response.status_code, 304)
+
+
+
+class MetricsTest(TestCase):
+    urls = 'styleguide.urls'
+
+    def test_build_counters(self):
+        from styleguide.signals import guide_built
+        received = []
+
+        def receiver(sender, metrics, **kwargs):
+            received.append(metrics)
+
+        guide_built.connect(receiver)
+        try:
+            collector = SourcesCollector({
+                "a.scss": "// A\n//\n// Styleguide 1\n\n// A.1\n//\n// Styleguide 1.1\n",
+                "b.scss": "",
+            })
+            builder = StyleGuideBuilder(collector, parse_cache=False, workers=0)
+            builder.get_style_guide()
+        finally:
+            guide_built.disconnect(receiver)
+
+        self.assertEquals(received, [builder.metrics])
+        self.assertEquals(builder.metrics.counters, {
+            'sources_read': 2, 'blocks_found': 2, 'sections_parsed': 2})
+        for stage in ("discover", "read", "comments", "parse", "sort"):
+            self.assertIn(stage, builder.metrics.timings)
+
+    def test_active_metrics(self):
+        from styleguide import metrics
+        outer = metrics.Metrics("outer")
+        inner = metrics.Metrics("inner")
+        with outer.activate():
+            metrics.incr("a")
+            with inner.activate():
+                metrics.incr("a", 2)
+            with metrics.timer("stage"):
+                pass
+        metrics.incr("a")
+        self.assertEquals(outer.counters, {'a': 1})
+        self.assertEquals(inner.counters, {'a': 2})
+        self.assertEquals(list(outer.timings), ["stage"])
+        self.assertIsNone(metrics.current())
+
+    def test_overlapping_memory_tracing(self):
+        import threading
+        from styleguide import metrics
+        if metrics.tracemalloc is None:
+            raise unittest.SkipTest("needs tracemalloc")
+        first = metrics.Metrics("first", trace_memory=True)
+        second = metrics.Metrics("second", trace_memory=True)
+        second_active = threading.Event()
+        first_done = threading.Event()
+
+        def build():
+            with second.activate():
+                second_active.set()
+                first_done.wait(5)
+                # still tracing after the first activation ended
+                data = [bytearray(1000) for _ in range(1000)]
+                del data
+
+        thread = threading.Thread(target=build)
+        with first.activate():
+            thread.start()
+            second_active.wait(5)
+        first_done.set()
+        thread.join()
+        self.assertFalse(metrics.tracemalloc.is_tracing())
+        self.assertTrue(second.peak_memory >= 1000 * 1000)
+
+    def test_memory_peak_is_per_activation(self):
+        from styleguide import metrics
+        if metrics.tracemalloc is None or not hasattr(metrics.tracemalloc, 'reset_peak'):
+            raise unittest.SkipTest("needs tracemalloc.reset_peak")
+        metrics.tracemalloc.start()
+        try:
+            data = [bytearray(1000) for _ in range(1000)]
+            del data
+            build = metrics.Metrics("build", trace_memory=True)
+            with build.activate():
+                pass
+            self.assertTrue(build.peak_memory < 1000 * 1000)
+            # tracing started elsewhere is left running
+            self.assertTrue(metrics.tracemalloc.is_tracing())
+        finally:
+            metrics.tracemalloc.stop()
+
+    def test_server_timing(self):
+        from styleguide.cache import invalidate
+        invalidate()
+        CountingSectionView.counting_collector = CountingCollector()
+        response = CountingSectionView.as_view()(RequestFactory().get("/section/1/"),
+                                                 position="1")
+        self.assertTrue(response.is_rendered)
+        stages = [timing.split(";")[0] for timing in response['Server-Timing'].split(", ")]
+        self.assertEquals(stages[:2], ["fingerprint", "guide"])
+        self.assertIn("render", stages)
+
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        from django.template import Context
+        self.context = Context({})
+        self.section = StyleGuideSection('1.1', 'Title', u'<p>Desc</p>', [], None)
+
+    def test_uncached_matches_include(self):
+        from django.template import Context, Template
+        included = Template('{% include "styleguide/styleguide_section.html" %}').render(
+            Context({'section': self.section}))
+        cache = FragmentCache(alias=None)
+        self.assertEquals(cache.render(self.section, self.context), included)
+
+    def test_caches_by_section_content(self):
+        cache = FragmentCache(alias='default', key_prefix="test-fragment")
+        html = cache.render(self.section, self.context)
+        self.assertEquals(cache.render(self.section, self.context), html)
+        self.assertEquals(cache.stats, {'hits': 1, 'misses': 1})
+
+        self.section.title = 'Changed'
+        self.assertIn('Changed', cache.render(self.section, self.context))
+        self.assertEquals(cache.stats, {'hits': 1, 'misses': 2})
+
+    def test_template_source(self):
+        self.assertIn("{% extends", get_template_source("styleguide/styleguide_section.html"))
+
+
+
+class BenchmarkTest(TestCase):
+
+    def test_generated_corpus_parses(self):
+        for comment_style in ("//", "/*"):
+            corpus = generate_corpus(files=3, sections=4, modifiers=2,
+                                     comment_style=comment_style)
+            guide = StyleGuideBuilder(CorpusCollector(corpus)).get_style_guide()
+            self.assertEquals(len(guide.sections), 12)
+            self.assertEquals([s.position for s in guide.get_root_sections()],
+                              ["1", "2", "3"])
+            self.assertEquals(len(guide.get_section("2.3").modifiers), 2)
+
+    def test_compare_results(self):
+        baseline = {"results": [{"scale": 1, "stages": {"kss": 1.0, "build": 1.0}}]}
+        current = {"results": [{"scale": 1, "stages": {"kss": 1.1, "build": 1.5}}]}
+        self.assertEquals(compare_results(baseline, current, threshold=0.2),
+                          [(1, "build", 1.0, 1.5)])
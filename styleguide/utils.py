@@ -0,0 +1,115 @@
+import os
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from importlib import import_module
+
+try:
+    from django.core.cache import caches
+except ImportError:
+    # Django < 1.7
+    from django.core.cache import get_cache
+else:
+    def get_cache(alias):
+        return caches[alias]
+
+
+def get_cache_backend(alias):
+    """
+    :return: Django cache backend for alias, or None if alias is None
+    """
+
+    if alias is None:
+        return None
+    return get_cache(alias)
+
+
+def import_string(dotted_path):
+    """
+    :return: the attribute named by the last part of dotted_path, from
+             the module named by the rest
+    """
+
+    module_path, name = dotted_path.rsplit(".", 1)
+    return getattr(import_module(module_path), name)
+
+
+# read once, as it can only be read by setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def atomic_write(path, data):
+    """
+    Writes data to path so that readers only ever see the old or the
+    complete new file, even with several processes writing at once.
+    """
+
+    directory = os.path.dirname(path) or "."
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = 0o666 & ~_umask
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        # mkstemp creates files only their owner can read; give them the
+        # mode of the file they replace, or of any new file
+        os.chmod(tmp_path, mode)
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            os.rename(tmp_path, path)
+    finally:
+        # only left behind if the write or rename failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def split_chunks(items, count):
+    """
+    :return: list of at most count contiguous slices of items
+    """
+
+    size = max(1, -(-len(items) // count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that keeps at most size entries, evicting the
+    least recently used first.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
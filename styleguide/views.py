@@ -1,8 +1,34 @@
-from django.core.urlresolvers import reverse
+import hashlib
+import logging
+from django.conf import settings
+try:
+    from django.urls import reverse
+except ImportError:
+    # Django < 1.10
+    from django.core.urlresolvers import reverse
+from django.views.decorators.http import condition
 from django.views.generic import RedirectView
 from django.views.generic.base import TemplateView
-from styleguide.builder import StyleGuideBuilder
-from styleguide.collector import FileCollector
+import styleguide
+from styleguide.artifact import ARTIFACT, get_artifact_guide, get_artifact_last_modified, \
+    get_artifact_stamp
+from styleguide.cache import get_entry
+from styleguide.collector import get_default_collector
+from styleguide import metrics
+from styleguide.fragments import FragmentStream
+from styleguide.signals import section_rendered
+from styleguide.watcher import WATCHER, get_watcher
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5
+    StreamingHttpResponse = None
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING = getattr(settings, 'STYLEGUIDE_SERVER_TIMING', True)
+STREAMING = getattr(settings, 'STYLEGUIDE_STREAMING', False)
 
 
 
@@ -16,16 +42,148 @@ class IndexView(RedirectView):
 
 
 class SectionView(TemplateView):
+    """
+    Renders a root section of the style guide.
+
+    Responses carry an ETag and Last-Modified derived from the
+    collector's fingerprint, so conditional requests are answered with
+    304 Not Modified before the guide is built or rendered.
+
+    Time spent in each stage of a request is logged, sent with the
+    section_rendered signal and reported in a Server-Timing header.
+
+    With streaming enabled, the page around the sections is sent first,
+    then each section's fragment is rendered and sent in turn.
+
+    With an artifact, the guide is loaded from it instead of being built
+    from the collector's stylesheets. With the watcher, the guide is
+    rebuilt in the background, and requests get the last one built.
+    """
+
+    streaming = STREAMING
+    artifact = ARTIFACT
+    watch = WATCHER
+    stale = False
 
     def dispatch(self, request, *args, **kwargs):
         request.position = kwargs.get("position", "1")
         return super(SectionView, self).dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        get = condition(etag_func=self.get_etag,
+                        last_modified_func=self.get_last_modified)(
+            super(SectionView, self).get)
+
+        self.metrics = metrics.Metrics("render")
+        with self.metrics.activate():
+            response = get(request, *args, **kwargs)
+            # render here rather than on the way out, so it gets timed
+            if hasattr(response, 'render') and not response.is_rendered:
+                with self.metrics.timer("render"):
+                    response.render()
+        return self.finish_response(request, response)
+
+    def finish_response(self, request, response):
+        """
+        Reports the metrics of the request, and adds them to response.
+        """
+
+        if self.stale:
+            # don't let clients keep the previous guide under the new ETag
+            del response['ETag']
+            del response['Last-Modified']
+
+        self.metrics.incr("status_%d" % response.status_code)
+        self.metrics.log()
+        section_rendered.send(sender=self.__class__, metrics=self.metrics,
+                              position=request.position)
+        if SERVER_TIMING:
+            response['Server-Timing'] = self.metrics.get_server_timing()
+        return response
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.use_streaming():
+            return super(SectionView, self).render_to_response(context, **response_kwargs)
+
+        stream = FragmentStream()
+        context['styleguide_stream'] = stream
+        response = super(SectionView, self).render_to_response(context, **response_kwargs)
+        # renders only the page around the sections, which are deferred
+        with metrics.timer("render"):
+            response.render()
+        # Django < 1.8 has no HttpResponse.charset
+        page = response.content.decode(getattr(response, 'charset', settings.DEFAULT_CHARSET))
+
+        streaming_response = StreamingHttpResponse(
+            stream.iter_page(page), status=response.status_code,
+            content_type=response['Content-Type'])
+        metrics.incr("sections_streamed", len(stream.deferred))
+        return streaming_response
+
+    def use_streaming(self):
+        if not self.streaming:
+            return False
+        if StreamingHttpResponse is None:
+            logger.warning("STYLEGUIDE_STREAMING needs Django >= 1.5, "
+                           "rendering the whole page")
+            return False
+        return True
+
     def get_context_data(self, **kwargs):
-        builder = StyleGuideBuilder(FileCollector())
-        guide = builder.get_style_guide()
+        fingerprint = self.fingerprint
+        with metrics.timer("guide"):
+            built_for, guide = self.get_guide_entry(fingerprint)
+        # a previous guide, served while another process builds
+        self.stale = built_for != fingerprint
+        return self.get_section_context(guide, self.request.position)
+
+    def get_guide_entry(self, fingerprint):
+        """
+        :return: (fingerprint the guide was built for, StyleGuide)
+        """
+
+        if self.artifact:
+            return fingerprint, get_artifact_guide(self.artifact, stamp=fingerprint)
+        if self.watch:
+            return fingerprint, self._watched_guide
+        return get_entry(self.collector, fingerprint=fingerprint)
 
-        sections = guide.get_sections(position=self.request.position)
+    @property
+    def collector(self):
+        if not hasattr(self, '_collector'):
+            self._collector = self.get_collector()
+        return self._collector
+
+    @property
+    def fingerprint(self):
+        if not hasattr(self, '_fingerprint'):
+            with metrics.timer("fingerprint"):
+                if self.artifact:
+                    self._fingerprint = get_artifact_stamp(self.artifact)
+                elif self.watch:
+                    watcher = get_watcher(self.collector)
+                    self._fingerprint, self._watched_guide = watcher.get_entry()
+                else:
+                    self._fingerprint = self.collector.get_fingerprint()
+        return self._fingerprint
+
+    def get_etag(self, request, *args, **kwargs):
+        if self.fingerprint is None:
+            return None
+        etag = hashlib.sha1(repr(self.fingerprint).encode('utf-8'))
+        etag.update(("\0%s\0%s" % (styleguide.__version__,
+                                    request.position)).encode('utf-8'))
+        return etag.hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        if self.fingerprint is None:
+            return None
+        if self.artifact:
+            return get_artifact_last_modified(self.fingerprint)
+        return self.collector.get_last_modified(self.fingerprint)
+
+    def get_section_context(self, guide, position):
+        sections = guide.get_sections(position=position)
         top_links = self.get_top_links(guide)
 
         return {
@@ -34,10 +192,16 @@ class SectionView(TemplateView):
             "top_links": top_links,
         }
 
+    def get_collector(self):
+        return get_default_collector()
+
     def get_template_names(self):
+        return self.get_section_template_names(self.request.position)
+
+    def get_section_template_names(self, position):
 
         override_template_name = "styleguide/styleguide_%s.html" \
-                                 % self.request.position
+                                 % position
         base_template_name = "styleguide/styleguide.html"
         return [override_template_name, base_template_name]
 
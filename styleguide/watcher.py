@@ -0,0 +1,153 @@
+import logging
+import threading
+from django.conf import settings
+from styleguide.builder import IncrementalStyleGuideBuilder
+from styleguide.collector import get_default_collector
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+logger = logging.getLogger(__name__)
+
+WATCHER = getattr(settings, 'STYLEGUIDE_WATCHER', False)
+# seconds between polls, or between checks for inotify events
+WATCHER_INTERVAL = getattr(settings, 'STYLEGUIDE_WATCHER_INTERVAL', 1.0)
+# seconds a request waits for the first guide to be built
+WATCHER_FIRST_BUILD_WAIT = 60
+
+if pyinotify is not None:
+    WATCHER_EVENTS = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                      pyinotify.IN_MODIFY | pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO)
+
+
+
+class GuideWatcher(object):
+    """
+    Keeps a StyleGuide up to date in a background thread, so requests
+    never wait for a rebuild.
+
+    The collector's roots are watched with inotify if pyinotify is
+    installed; otherwise, or for collectors without roots, the
+    collector's fingerprint is polled. Requests are served the last
+    good guide until a rebuild finishes and replaces it, and a rebuild
+    that fails leaves it in place.
+    """
+
+    def __init__(self, collector=None, interval=WATCHER_INTERVAL,
+                 builder_class=IncrementalStyleGuideBuilder, use_inotify=True):
+        if collector is None:
+            collector = get_default_collector()
+        self.collector = collector
+        self.interval = interval
+        self.builder = builder_class(collector)
+        self.use_inotify = use_inotify and pyinotify is not None \
+            and bool(getattr(collector, 'roots', None))
+        self._entry = None
+        self._ready = threading.Event()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="styleguide-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_entry(self):
+        """
+        :return: (fingerprint, StyleGuide) last built, waiting for the
+                 first build if it hasn't finished
+        """
+
+        self._ready.wait(WATCHER_FIRST_BUILD_WAIT)
+        entry = self._entry
+        if entry is None:
+            raise RuntimeError("The style guide has not been built, see the log")
+        return entry
+
+    def get_style_guide(self):
+        return self.get_entry()[1]
+
+    def run(self):
+        notifier = self.get_notifier() if self.use_inotify else None
+        try:
+            self.refresh()
+            while not self._stopped.is_set():
+                if notifier is None:
+                    self._stopped.wait(self.interval)
+                    self.refresh()
+                    continue
+                if notifier.check_events(int(self.interval * 1000)):
+                    notifier.read_events()
+                    notifier.process_events()
+                if self._changed.is_set():
+                    self._changed.clear()
+                    self.refresh()
+        finally:
+            if notifier is not None:
+                notifier.stop()
+
+    def get_notifier(self):
+        watcher = self
+
+        class ChangeHandler(pyinotify.ProcessEvent):
+
+            def process_default(self, event):
+                watcher._changed.set()
+
+        manager = pyinotify.WatchManager()
+        for root in self.collector.roots:
+            manager.add_watch(root, WATCHER_EVENTS, rec=True, auto_add=True)
+        return pyinotify.Notifier(manager, ChangeHandler())
+
+    def refresh(self):
+        """
+        Rebuilds the guide if the collector's fingerprint has changed.
+        """
+
+        try:
+            fingerprint = self.collector.get_fingerprint()
+            if self._entry is not None and fingerprint is not None \
+                    and self._entry[0] == fingerprint:
+                return
+            guide = self.builder.get_style_guide()
+        except Exception:
+            logger.exception("Unable to rebuild the style guide, "
+                             "serving the previous one")
+            # requests waiting for a first guide get an error rather
+            # than hang if it can't be built
+            self._ready.set()
+            return
+        self._entry = (fingerprint, guide)
+        self._ready.set()
+
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_watcher(collector=None):
+    """
+    :return: the process's GuideWatcher for collectors with the same
+             cache key as collector, by default the default collector,
+             started on first use
+    """
+
+    if collector is None:
+        collector = get_default_collector()
+    key = collector.get_cache_key()
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = _watchers[key] = GuideWatcher(collector)
+            watcher.start()
+    return watcher